@@ -4,8 +4,8 @@ from typing import List, Dict, Any
 from sqlalchemy.orm import Session
 from app.models.database import SessionLocal, DatabaseConnection
 from app.services.connectors import get_connector
-from app.services.rag_service import RAGService
-from app.services.rag_service_local import LocalRAGService
+from app.services.rag_service import get_rag_service
+from app.services.rag_service_local import get_local_rag_service
 from app.services.schema_store import get_schema_store
 from app.core.config import settings
 import logging
@@ -93,14 +93,10 @@ async def create_connection(
         # Create vector store for RAG with data
         if settings.USE_LOCAL_MODELS:
             logger.info("Using local RAG service for indexing")
-            rag_service = LocalRAGService(
-                embedding_service_url=settings.EMBEDDING_SERVICE_URL,
-                ollama_base_url=settings.OLLAMA_BASE_URL,
-                ollama_model=settings.OLLAMA_MODEL
-            )
+            rag_service = get_local_rag_service()
         else:
             logger.info("Using cloud RAG service for indexing")
-            rag_service = RAGService()
+            rag_service = get_rag_service()
         
         rag_service.create_vector_store(db_connection.id, schema, sample_data)
         
@@ -183,6 +179,8 @@ async def refresh_schema(connection_id: int, db: Session = Depends(get_db)):
         connector.connect(connection.connection_string)
         
         logger.info(f"Refreshing schema for connection {connection_id}")
+        if hasattr(connector, "invalidate_schema_cache"):
+            connector.invalidate_schema_cache()
         schema = connector.get_enhanced_schema()
         
         # Update connection
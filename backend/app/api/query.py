@@ -3,9 +3,9 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from app.models.database import SessionLocal, DatabaseConnection, QueryHistory
-from app.services.rag_service import RAGService
-from app.services.rag_service_local import LocalRAGService
-from app.services.connectors import get_connector
+from app.services.rag_service import get_rag_service
+from app.services.rag_service_local import get_local_rag_service
+from app.services.connectors import get_connector, parse_mongo_query
 from app.services.schema_store import get_schema_store
 from app.services.query_validator import QueryValidator
 from app.services.pii_redaction import create_redactor
@@ -16,13 +16,17 @@ from app.core.security import get_security_manager
 import logging
 import re
 import asyncio
-from typing import List, Dict, Any, Optional
+from contextlib import closing
+from itertools import islice
+from typing import Iterator, List, Dict, Any, Optional
 import time
 import json
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+MAX_RESULT_ROWS = 100
+
 class LLMConfig(BaseModel):
     provider: str = "openai"
     api_key: str | None = None
@@ -89,17 +93,20 @@ async def execute_database_query_safely(connection: DatabaseConnection, query: s
             if "limit" not in query.lower() and "select" in query.lower():
                 query = f"{query.rstrip(';')} LIMIT 100"
             
-            results = connector.execute_query(query)
+            rows = connector.iter_query(query)
         elif connection.db_type == "mongodb":
             try:
-                query_obj = json.loads(query)
-                results = connector.execute_query(query_obj)
+                query_obj = parse_mongo_query(query)
             except json.JSONDecodeError:
                 raise ValueError("Invalid MongoDB query format")
+            rows = connector.iter_query(query_obj)
         else:
-            results = []
+            return []
         
-        return results[:100]  # Limit results
+        # Limit results without materializing rows beyond the cap, then
+        # release the server-side cursor before the connection closes
+        with closing(rows):
+            return list(islice(rows, MAX_RESULT_ROWS))
         
     finally:
         connector.close()
@@ -144,6 +151,36 @@ def format_row(row: Dict) -> str:
     
     return " | ".join(parts) if parts else "No data"
 
+def stream_and_record(chunks: Iterator[str], user_query: str, connection_id: int) -> Iterator[str]:
+    """Relay a streamed answer, then audit it and save the joined text to history"""
+    parts = []
+    completed = False
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        completed = True
+    finally:
+        try:
+            get_security_manager().audit_log(
+                action="query_execution",
+                user_id=1,  # TODO: Get from auth
+                connection_id=connection_id,
+                query=user_query,
+                success=completed
+            )
+            # The request's session is closed once the response starts
+            with closing(SessionLocal()) as db:
+                db.add(QueryHistory(
+                    user_id=1,
+                    connection_id=connection_id,
+                    query=user_query,
+                    response="".join(parts)
+                ))
+                db.commit()
+        except Exception as e:
+            logger.error(f"Failed to record streamed query: {e}")
+
 @router.post("/", response_model=QueryResponse)
 async def execute_query(
     request: QueryRequest,
@@ -182,15 +219,17 @@ async def execute_query(
         if request.llm_config and request.llm_config.api_key:
             use_local = False
         
+        if request.stream and use_local:
+            raise HTTPException(
+                status_code=400,
+                detail="Streaming is only supported with a cloud LLM. Configure one in LLM Settings or disable streaming."
+            )
+        
         # Initialize RAG service
         if use_local:
             logger.info("Using local RAG service")
             try:
-                rag_service = LocalRAGService(
-                    embedding_service_url=settings.EMBEDDING_SERVICE_URL,
-                    ollama_base_url=settings.OLLAMA_BASE_URL,
-                    ollama_model=settings.OLLAMA_MODEL
-                )
+                rag_service = get_local_rag_service()
             except Exception as e:
                 logger.error(f"Failed to initialize local RAG service: {e}")
                 raise HTTPException(
@@ -208,7 +247,7 @@ async def execute_query(
                 )
             
             try:
-                rag_service = RAGService(llm_config=llm_config_dict)
+                rag_service = get_rag_service(llm_config_dict)
             except Exception as e:
                 logger.error(f"Failed to initialize cloud RAG service: {e}")
                 raise HTTPException(
@@ -216,8 +255,23 @@ async def execute_query(
                     detail=f"Failed to initialize cloud LLM service: {str(e)}"
                 )
         
-        # Use RAG to answer query
-        answer = rag_service.query_with_rag(user_query, connection.id)
+        # Streamed answers skip query generation/execution and are sent as
+        # text as the cloud LLM produces it; audit and history follow the stream
+        if request.stream:
+            return StreamingResponse(
+                stream_and_record(
+                    rag_service.stream_query_with_rag(user_query, connection.id),
+                    user_query,
+                    connection.id
+                ),
+                media_type="text/plain"
+            )
+        
+        # Use RAG to answer query; the local service awaits Ollama directly
+        if use_local:
+            answer = await rag_service.aquery_with_rag(user_query, connection.id)
+        else:
+            answer = await asyncio.to_thread(rag_service.query_with_rag, user_query, connection.id)
         
         generated_query = None
         query_results = None
@@ -249,9 +303,9 @@ async def execute_query(
                         connection, generated_query, db_type
                     )
                     
-                    # Apply PII redaction
-                    redactor = create_redactor(use_presidio=True)
-                    query_results = redactor.redact_results(query_results)
+                    # Apply PII redaction off the event loop (model load + NLP pass)
+                    redactor = await asyncio.to_thread(create_redactor, True)
+                    query_results = await asyncio.to_thread(redactor.redact_results, query_results)
                     
                     # Enhance answer with formatted results
                     results_message = format_query_results(query_results, generated_query, db_type)
@@ -0,0 +1,12 @@
+"""
+Shared thread pool for blocking work offloaded from async request handlers
+Installed as the event loop's default executor on startup, so
+asyncio.to_thread and run_in_executor(None, ...) use it too
+"""
+from concurrent.futures import ThreadPoolExecutor
+from app.core.config import settings
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RAG_THREAD_POOL_SIZE,
+    thread_name_prefix="rag"
+)
@@ -5,11 +5,51 @@ Multi-layer security for database access
 
 from typing import Dict, Any, List, Set, Optional
 from functools import wraps
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 import logging
 import hashlib
+import queue
 import re
+from urllib.parse import urlsplit, urlunsplit
 
 logger = logging.getLogger(__name__)
+audit_logger = logging.getLogger(f"{__name__}.audit")
+
+# Background listener that performs audit handler I/O off the request path
+_audit_listener: Optional[QueueListener] = None
+
+def start_audit_listener(handlers: Optional[List[logging.Handler]] = None):
+    """
+    Route audit records through an in-memory queue
+    
+    Request handlers only enqueue the record; formatting and writing happen
+    on the listener thread. Defaults to the root logger's handlers.
+    """
+    global _audit_listener
+    if _audit_listener is not None:
+        return
+    
+    handlers = handlers or logging.getLogger().handlers or [logging.StreamHandler()]
+    audit_queue = queue.SimpleQueue()
+    audit_logger.addHandler(QueueHandler(audit_queue))
+    audit_logger.propagate = False
+    
+    _audit_listener = QueueListener(audit_queue, *handlers, respect_handler_level=True)
+    _audit_listener.start()
+
+def stop_audit_listener():
+    """Flush pending audit records and stop the listener thread"""
+    global _audit_listener
+    if _audit_listener is None:
+        return
+    
+    _audit_listener.stop()
+    _audit_listener = None
+    for handler in list(audit_logger.handlers):
+        if isinstance(handler, QueueHandler):
+            audit_logger.removeHandler(handler)
+    audit_logger.propagate = True
 
 class SecurityManager:
     """
@@ -44,9 +84,21 @@ class SecurityManager:
         'sqlite_master', 'sqlite_temp_master'
     }
     
+    # Null bytes and control characters (except newline, CR, tab) to strip
+    CONTROL_CHAR_TABLE = dict.fromkeys(
+        i for i in range(32) if chr(i) not in '\n\r\t'
+    )
+    
+    MAX_INPUT_LENGTH = 10000
+    
     def __init__(self):
         self.compiled_patterns = [re.compile(p, re.IGNORECASE) 
                                  for p in self.SQL_INJECTION_PATTERNS]
+        # All patterns in one alternation for the common "is it safe?" check
+        self.combined_pattern = re.compile(
+            '|'.join(f'(?:{p})' for p in self.SQL_INJECTION_PATTERNS),
+            re.IGNORECASE
+        )
     
     def sanitize_input(self, user_input: str) -> str:
         """
@@ -55,18 +107,8 @@ class SecurityManager:
         if not user_input:
             return ""
         
-        # Remove null bytes
-        sanitized = user_input.replace('\x00', '')
-        
-        # Remove control characters
-        sanitized = ''.join(char for char in sanitized if ord(char) >= 32 or char in '\n\r\t')
-        
-        # Limit length
-        max_length = 10000
-        if len(sanitized) > max_length:
-            sanitized = sanitized[:max_length]
-        
-        return sanitized
+        # Remove null bytes and control characters, then limit length
+        return user_input.translate(self.CONTROL_CHAR_TABLE)[:self.MAX_INPUT_LENGTH]
     
     def check_sql_injection(self, query: str) -> tuple[bool, List[str]]:
         """
@@ -75,6 +117,11 @@ class SecurityManager:
         Returns:
             (is_safe, list_of_detected_patterns)
         """
+        # Clean queries take a single pass; only suspicious ones get the
+        # per-pattern scan that reports what matched
+        if not self.is_injection(query):
+            return True, []
+        
         detected = []
         
         for i, pattern in enumerate(self.compiled_patterns):
@@ -84,6 +131,10 @@ class SecurityManager:
         is_safe = len(detected) == 0
         return is_safe, detected
     
+    def is_injection(self, query: str) -> bool:
+        """Fast check: stops at the first injection pattern found"""
+        return self.combined_pattern.search(query) is not None
+    
     def validate_table_access(self, tables: List[str], 
                              allowed_tables: Optional[Set[str]] = None) -> bool:
         """
@@ -126,30 +177,39 @@ class SecurityManager:
         """
         Log security-relevant actions
         """
+        level = logging.INFO if success else logging.WARNING
+        if not audit_logger.isEnabledFor(level):
+            return
+        
         log_entry = {
-            "timestamp": logging.Formatter().formatTime(logging.LogRecord(
-                'name', logging.INFO, '', 0, '', (), None
-            )),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
             "action": action,
             "user_id": user_id,
             "connection_id": connection_id,
-            "query_hash": hashlib.sha256(query.encode()).hexdigest()[:16],
+            "query_hash": hashlib.blake2b(query.encode(), digest_size=8).hexdigest(),
             "success": success,
             "error": error
         }
         
-        if success:
-            logger.info(f"AUDIT: {log_entry}")
-        else:
-            logger.warning(f"AUDIT: {log_entry}")
+        audit_logger.log(level, "AUDIT: %s", log_entry)
     
     def mask_connection_string(self, connection_string: str) -> str:
         """
         Mask sensitive info in connection string for logging
         """
-        # Mask password
-        masked = re.sub(r':([^:@]+)@', ':****@', connection_string)
-        return masked
+        try:
+            parts = urlsplit(connection_string)
+        except ValueError:
+            # Malformed netloc (e.g. an unclosed IPv6 bracket); mask by pattern
+            return re.sub(r':([^:@]+)@', ':****@', connection_string)
+        userinfo, at, hosts = parts.netloc.rpartition('@')
+        if not at or ':' not in userinfo:
+            return connection_string
+        
+        # Rebuild netloc with the password replaced; hosts are kept verbatim
+        # so IPv6 literals and multi-host MongoDB URIs survive intact
+        username = userinfo.split(':', 1)[0]
+        return urlunsplit(parts._replace(netloc=f"{username}:****@{hosts}"))
 
 class RateLimiter:
     """
@@ -1,27 +1,39 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.api import auth, connections, query, settings
 from app.core.config import settings as app_settings
+from app.core.executor import executor
+from app.core.security import start_audit_listener, stop_audit_listener
 from app.models.database import init_db
+import asyncio
 
 app = FastAPI(
     title="Universal RAG Platform",
     description="AI-powered database query system with RAG",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
-# Initialize database tables on startup
+# Verify database schema is migrated on startup
 @app.on_event("startup")
 async def startup_event():
+    asyncio.get_running_loop().set_default_executor(executor)
     init_db()
+    start_audit_listener()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    stop_audit_listener()
+    executor.shutdown(wait=False)
 
 # CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=app_settings.CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type"],
 )
 
 # Routes
@@ -1,8 +1,12 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON, Index, LargeBinary, func, text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from pgvector.sqlalchemy import Vector
 from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
 
 engine = create_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -14,7 +18,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class UserSettings(Base):
     __tablename__ = "user_settings"
@@ -24,11 +28,14 @@ class UserSettings(Base):
     llm_provider = Column(String, default="openai")  # openai, gemini, anthropic
     llm_api_key = Column(Text)  # encrypted API key
     llm_model = Column(String, default="gpt-3.5-turbo")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 class DatabaseConnection(Base):
     __tablename__ = "database_connections"
+    __table_args__ = (
+        Index("ix_database_connections_user_id_name", "user_id", "name"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, index=True)
@@ -36,17 +43,43 @@ class DatabaseConnection(Base):
     db_type = Column(String)  # postgresql, mongodb
     connection_string = Column(Text)  # encrypted
     db_metadata = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class QueryHistory(Base):
     __tablename__ = "query_history"
+    __table_args__ = (
+        Index("ix_query_history_user_id_created_at", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, index=True)
     connection_id = Column(Integer)
     query = Column(Text)
     response = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class EmbeddingCache(Base):
+    __tablename__ = "embedding_cache"
+    
+    hash = Column(LargeBinary, primary_key=True)  # sha256 of the embedded text
+    provider = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    vec = Column(Vector())  # no fixed dimension; providers differ
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    """
+    Verify the schema has been migrated.
+    
+    Tables are created by `alembic upgrade head`, run once before the API
+    workers start. Only when no migration has ever been applied (e.g. a
+    local dev database) do we fall back to create_all().
+    """
+    try:
+        with engine.connect() as conn:
+            version = conn.execute(text("SELECT version_num FROM alembic_version")).scalar_one()
+        logger.info(f"Database schema at revision {version}")
+    except SQLAlchemyError:
+        logger.warning("No alembic revision found; creating tables directly. Run `alembic upgrade head`.")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        Base.metadata.create_all(bind=engine)
@@ -1,10 +1,27 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from datetime import datetime
 from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Engine
 from pymongo import MongoClient
+from pymongo.errors import ConfigurationError
+from bson import ObjectId
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+from pathlib import Path
+from app.core.config import settings
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Rows/documents fetched per round-trip when streaming query results
+STREAM_BATCH_SIZE = 1000
+
 class DatabaseConnector:
     """Base class for database connectors"""
     
@@ -18,83 +35,251 @@ class DatabaseConnector:
         """Get schema with metadata (PK, FK, indexes)"""
         raise NotImplementedError
     
-    def execute_query(self, query: str) -> List[Dict]:
+    def iter_query(self, query: str) -> Iterator[Dict]:
+        """Execute query, yielding result rows one at a time"""
         raise NotImplementedError
+    
+    def execute_query(self, query: str) -> List[Dict]:
+        return list(self.iter_query(query))
+
+# One cheap catalog query whose result changes with any DDL affecting the
+# enhanced schema (columns, types incl. length/precision modifiers,
+# nullability, defaults, constraints, indexes)
+SCHEMA_VERSION_QUERY = """
+SELECT md5(
+    coalesce((
+        SELECT string_agg(
+            c.relname || '.' || a.attname || ':' || a.atttypid || ':' || a.atttypmod
+                || ':' || a.attnotnull || ':' || coalesce(pg_get_expr(d.adbin, d.adrelid), ''),
+            ',' ORDER BY c.relname, a.attnum)
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE n.nspname = current_schema()
+          AND c.relkind IN ('r', 'p', 'v', 'm')
+          AND a.attnum > 0 AND NOT a.attisdropped
+    ), '') || '|' ||
+    coalesce((
+        SELECT string_agg(con.oid::text, ',' ORDER BY con.oid)
+        FROM pg_constraint con
+        JOIN pg_namespace n ON n.oid = con.connamespace
+        WHERE n.nspname = current_schema()
+    ), '') || '|' ||
+    coalesce((
+        SELECT string_agg(i.indexrelid::text, ',' ORDER BY i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema()
+    ), '')
+)
+"""
 
 class PostgreSQLConnector(DatabaseConnector):
+    # Reflected schemas shared across connector instances:
+    # {(connection hash, kind): (cached_at, schema)}
+    SCHEMA_CACHE_TTL = 300
+    _schema_cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+    
+    # LRU of pooled engines shared across connector instances: {connection hash: engine}
+    _engines: "OrderedDict[str, Engine]" = OrderedDict()
+    _engines_lock = threading.Lock()
+    
     def __init__(self):
         self.engine = None
-        self.connection = None
+        self._cache_key = None
+        self._inspector = None
     
     def connect(self, connection_string: str):
         try:
-            self.engine = create_engine(connection_string)
-            self.connection = self.engine.connect()
+            self._cache_key = hashlib.sha256(connection_string.encode()).hexdigest()
+            self.engine = self._get_engine(connection_string)
             logger.info("PostgreSQL connection established")
             return True
         except Exception as e:
             logger.error(f"PostgreSQL connection failed: {e}")
             raise
     
+    def _get_engine(self, connection_string: str) -> Engine:
+        """Get the pooled engine for this database, creating and verifying it once"""
+        with self._engines_lock:
+            engine = self._engines.get(self._cache_key)
+            if engine is not None:
+                self._engines.move_to_end(self._cache_key)
+                return engine
+        
+        engine = create_engine(
+            connection_string,
+            pool_size=settings.USER_DB_POOL_SIZE,
+            max_overflow=settings.USER_DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            pool_timeout=5
+        )
+        try:
+            with engine.connect():
+                pass
+        except Exception:
+            engine.dispose()
+            raise
+        
+        evicted = []
+        with self._engines_lock:
+            existing = self._engines.get(self._cache_key)
+            if existing is not None:
+                # Another request created one first; keep that
+                evicted.append(engine)
+                engine = existing
+            else:
+                self._engines[self._cache_key] = engine
+            self._engines.move_to_end(self._cache_key)
+            while len(self._engines) > settings.USER_DB_MAX_ENGINES:
+                evicted.append(self._engines.popitem(last=False)[1])
+        
+        # Checked-out connections finish normally; idle ones are closed
+        for stale in evicted:
+            stale.dispose()
+        return engine
+    
+    def _get_cached_schema(self, kind: str) -> Optional[Dict[str, Any]]:
+        entry = self._schema_cache.get((self._cache_key, kind))
+        if entry and time.monotonic() - entry[0] < self.SCHEMA_CACHE_TTL:
+            return entry[1]
+        return None
+    
+    def _set_cached_schema(self, kind: str, schema: Dict[str, Any]):
+        self._schema_cache[(self._cache_key, kind)] = (time.monotonic(), schema)
+    
+    @property
+    def inspector(self):
+        """Inspector reused across calls so its reflection info_cache is kept"""
+        if self._inspector is None:
+            self._inspector = inspect(self.engine)
+        return self._inspector
+    
+    def invalidate_schema_cache(self):
+        """Drop cached schemas for this connection (e.g. after DDL)"""
+        self._inspector = None
+        for kind in ("basic", "enhanced"):
+            self._schema_cache.pop((self._cache_key, kind), None)
+        
+        try:
+            self._disk_cache_path().unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not remove schema cache file: {e}")
+    
+    def _disk_cache_path(self) -> Path:
+        return Path(settings.SCHEMA_CACHE_DIR) / f"{self._cache_key}.json"
+    
+    def _schema_version(self) -> str:
+        """Fingerprint of the current schema's tables, columns, constraints and indexes"""
+        with self.engine.connect() as conn:
+            return conn.execute(text(SCHEMA_VERSION_QUERY)).scalar() or ""
+    
+    def _load_disk_schema(self, version: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._disk_cache_path()) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry["schema"] if entry.get("version") == version else None
+    
+    def _save_disk_schema(self, version: str, schema: Dict[str, Any]):
+        path = self._disk_cache_path()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump({"version": version, "schema": schema}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write schema cache file: {e}")
+    
     def get_schema(self) -> Dict[str, Any]:
         """Basic schema extraction"""
-        inspector = inspect(self.engine)
+        cached = self._get_cached_schema("basic")
+        if cached is not None:
+            return cached
+        
+        inspector = self.inspector
         schema = {}
         
-        for table_name in inspector.get_table_names():
-            columns = []
-            for column in inspector.get_columns(table_name):
-                columns.append({
-                    "name": column["name"],
-                    "type": str(column["type"])
-                })
-            schema[table_name] = columns
+        # One query for every table's columns, keyed by (schema, table)
+        for (_, table_name), table_columns in inspector.get_multi_columns().items():
+            schema[table_name] = [
+                {"name": column["name"], "type": str(column["type"])}
+                for column in table_columns
+            ]
         
+        self._set_cached_schema("basic", schema)
         return schema
     
     def get_enhanced_schema(self) -> Dict[str, Any]:
         """
         Enhanced schema with PK, FK, indexes, and relationships
         """
-        inspector = inspect(self.engine)
+        cached = self._get_cached_schema("enhanced")
+        if cached is not None:
+            return cached
+        
+        # Reuse the reflection from disk while the schema fingerprint is unchanged
+        version = self._schema_version()
+        cached = self._load_disk_schema(version)
+        if cached is not None:
+            self._set_cached_schema("enhanced", cached)
+            return cached
+        
+        inspector = self.inspector
         schema = {}
         
-        for table_name in inspector.get_table_names():
-            columns = []
+        # Batched reflection: each get_multi_* call is a single query
+        # covering all tables, keyed by (schema, table)
+        all_columns = inspector.get_multi_columns()
+        
+        all_pks = {}
+        try:
+            all_pks = inspector.get_multi_pk_constraint()
+        except Exception as e:
+            logger.warning(f"Could not get primary keys: {e}")
+        
+        all_fks = {}
+        try:
+            all_fks = inspector.get_multi_foreign_keys()
+        except Exception as e:
+            logger.warning(f"Could not get foreign keys: {e}")
+        
+        all_indexes = {}
+        try:
+            all_indexes = inspector.get_multi_indexes()
+        except Exception as e:
+            logger.warning(f"Could not get indexes: {e}")
+        
+        for key, table_columns in all_columns.items():
+            table_name = key[1]
             
-            # Get primary key
-            pk_columns = set()
-            try:
-                pk_info = inspector.get_pk_constraint(table_name)
-                pk_columns = set(pk_info.get('constrained_columns', []))
-            except Exception as e:
-                logger.warning(f"Could not get PK for {table_name}: {e}")
+            # Primary key
+            pk_info = all_pks.get(key) or {}
+            pk_columns = set(pk_info.get('constrained_columns') or [])
             
-            # Get foreign keys
+            # Foreign keys
             fk_info = {}
-            try:
-                fks = inspector.get_foreign_keys(table_name)
-                for fk in fks:
-                    for col in fk.get('constrained_columns', []):
-                        fk_info[col] = {
-                            'referred_table': fk.get('referred_table'),
-                            'referred_columns': fk.get('referred_columns', [])
-                        }
-            except Exception as e:
-                logger.warning(f"Could not get FK for {table_name}: {e}")
+            for fk in all_fks.get(key, []):
+                for col in fk.get('constrained_columns', []):
+                    fk_info[col] = {
+                        'referred_table': fk.get('referred_table'),
+                        'referred_columns': fk.get('referred_columns', [])
+                    }
             
-            # Get indexes
+            # Indexes
             indexes = {}
-            try:
-                idx_info = inspector.get_indexes(table_name)
-                for idx in idx_info:
-                    for col in idx.get('column_names', []):
-                        indexes[col] = idx.get('unique', False)
-            except Exception as e:
-                logger.warning(f"Could not get indexes for {table_name}: {e}")
+            for idx in all_indexes.get(key, []):
+                for col in idx.get('column_names', []):
+                    indexes[col] = idx.get('unique', False)
             
             # Build column info
-            for column in inspector.get_columns(table_name):
+            columns = []
+            for column in table_columns:
                 col_name = column["name"]
                 col_info = {
                     "name": col_name,
@@ -110,15 +295,84 @@ class PostgreSQLConnector(DatabaseConnector):
             
             schema[table_name] = columns
         
+        self._set_cached_schema("enhanced", schema)
+        self._save_disk_schema(version, schema)
         return schema
     
-    def execute_query(self, query: str) -> List[Dict]:
-        result = self.connection.execute(text(query))
-        return [dict(row._mapping) for row in result]
+    def iter_query(self, query: str) -> Iterator[Dict]:
+        # Pooled connection, returned to the pool when the generator finishes
+        # or is closed; server-side cursor fetches rows in chunks
+        with self.engine.connect() as conn:
+            result = conn.execute(
+                text(query),
+                execution_options={"stream_results": True, "yield_per": STREAM_BATCH_SIZE}
+            )
+            try:
+                # Resolve column names once and zip them with each plain row tuple,
+                # rather than building a RowMapping per row
+                keys = tuple(result.keys())
+                for row in result.tuples():
+                    yield dict(zip(keys, row))
+            finally:
+                result.close()
     
     def close(self):
-        if self.connection:
-            self.connection.close()
+        # The engine is shared through the _engines cache, whose eviction
+        # disposes it; only drop this connector's inspector
+        self._inspector = None
+
+# Samples up to 100 documents and groups their top-level fields by BSON type
+SCHEMA_SAMPLE_PIPELINE = [
+    {"$sample": {"size": 100}},
+    {"$project": {"kv": {"$objectToArray": "$$ROOT"}}},
+    {"$unwind": "$kv"},
+    {"$group": {"_id": {"k": "$kv.k", "t": {"$type": "$kv.v"}}, "n": {"$sum": 1}}}
+]
+
+# $type aliases mapped to the Python type names the schema has always reported
+BSON_TYPE_NAMES = {
+    "double": "float",
+    "string": "str",
+    "object": "dict",
+    "array": "list",
+    "binData": "bytes",
+    "objectId": "ObjectId",
+    "bool": "bool",
+    "date": "datetime",
+    "null": "NoneType",
+    "regex": "Regex",
+    "int": "int",
+    "long": "int",
+    "timestamp": "Timestamp",
+    "decimal": "Decimal128"
+}
+
+@lru_cache(maxsize=256)
+def parse_mongo_query(query: str) -> Dict[str, Any]:
+    """
+    Parse a MongoDB JSON query, reusing the result for repeated query strings
+    
+    The returned dict is shared between callers and must not be modified.
+    """
+    return json.loads(query)
+
+class _ObjectIdStrDecoder(TypeDecoder):
+    bson_type = ObjectId
+    
+    def transform_bson(self, value):
+        return str(value)
+
+class _DatetimeIsoDecoder(TypeDecoder):
+    bson_type = datetime
+    
+    def transform_bson(self, value):
+        return value.isoformat()
+
+# Decodes query results straight into JSON-friendly values (applied to
+# nested documents and arrays as well)
+QUERY_CODEC_OPTIONS = CodecOptions(
+    type_registry=TypeRegistry([_ObjectIdStrDecoder(), _DatetimeIsoDecoder()])
+)
 
 class MongoDBConnector(DatabaseConnector):
     def __init__(self):
@@ -128,9 +382,13 @@ class MongoDBConnector(DatabaseConnector):
     def connect(self, connection_string: str):
         try:
             self.client = MongoClient(connection_string)
-            # Extract database name from connection string
-            db_name = connection_string.split("/")[-1].split("?")[0]
-            
+            # Reuse the URI parse MongoClient already did (handles mongodb+srv,
+            # percent-encoded credentials and query options correctly)
+            try:
+                db_name = self.client.get_default_database().name
+            except ConfigurationError:
+                db_name = None
+
             if not db_name:
                 # Try to get the first available database
                 db_names = self.client.list_database_names()
@@ -173,39 +431,35 @@ class MongoDBConnector(DatabaseConnector):
         for collection_name in self.db.list_collection_names():
             collection = self.db[collection_name]
             
-            # Sample documents for field inference
-            samples = list(collection.find().limit(100))
+            # Infer field types server-side: one row per (field, BSON type)
+            # instead of shipping 100 full documents to Python
+            field_types = {}
+            sample_counts = Counter()
+            for row in collection.aggregate(SCHEMA_SAMPLE_PIPELINE):
+                key = row["_id"]["k"]
+                bson_type = row["_id"]["t"]
+                field_types.setdefault(key, set()).add(BSON_TYPE_NAMES.get(bson_type, bson_type))
+                sample_counts[key] += row["n"]
             
-            if samples:
-                # Infer fields from multiple samples
-                field_types = {}
-                for sample in samples:
-                    for key, value in sample.items():
-                        if key not in field_types:
-                            field_types[key] = set()
-                        field_types[key].add(type(value).__name__)
+            if field_types:
+                # Fetch index definitions once rather than per field
+                indexed_fields = set()
+                try:
+                    for idx in collection.list_indexes():
+                        indexed_fields.update(idx.get('key', {}).keys())
+                except Exception as e:
+                    logger.warning(f"Could not get indexes for {collection_name}: {e}")
                 
                 fields = []
                 for key, types in field_types.items():
                     # Get most common type
                     type_str = list(types)[0] if len(types) == 1 else f"Union[{', '.join(types)}]"
                     
-                    # Check if field is indexed
-                    is_indexed = False
-                    try:
-                        indexes = collection.list_indexes()
-                        for idx in indexes:
-                            if key in idx.get('key', {}):
-                                is_indexed = True
-                                break
-                    except:
-                        pass
-                    
                     fields.append({
                         "name": key,
                         "type": type_str,
-                        "indexed": is_indexed,
-                        "sample_count": len([s for s in samples if key in s])
+                        "indexed": key in indexed_fields,
+                        "sample_count": sample_counts[key]
                     })
                 
                 # Add collection statistics
@@ -215,9 +469,15 @@ class MongoDBConnector(DatabaseConnector):
                 except:
                     pass
                 
+                # Only fall back to collection metadata when collStats is unavailable
+                if 'count' in stats:
+                    document_count = stats['count']
+                else:
+                    document_count = collection.estimated_document_count()
+                
                 schema[collection_name] = {
                     "fields": fields,
-                    "document_count": stats.get('count', collection.count_documents({})),
+                    "document_count": document_count,
                     "size_bytes": stats.get('size', 0),
                     "avg_document_size": stats.get('avgObjSize', 0)
                 }
@@ -226,11 +486,10 @@ class MongoDBConnector(DatabaseConnector):
         
         return schema
     
-    def execute_query(self, query: str) -> List[Dict]:
+    def iter_query(self, query: str) -> Iterator[Dict]:
         """Execute MongoDB query from JSON string"""
         try:
-            import json
-            query_obj = json.loads(query) if isinstance(query, str) else query
+            query_obj = parse_mongo_query(query) if isinstance(query, str) else query
             
             # Extract collection and filter
             collection_name = query_obj.get('collection')
@@ -244,27 +503,11 @@ class MongoDBConnector(DatabaseConnector):
                 else:
                     raise ValueError("No collection specified and no collections found")
             
-            # Execute query
-            cursor = self.db[collection_name].find(filter_dict).limit(limit)
-            results = list(cursor)
-            
-            # Convert ObjectId to string
-            def convert_objectids(obj):
-                from bson import ObjectId
-                from datetime import datetime
-                
-                if isinstance(obj, ObjectId):
-                    return str(obj)
-                elif isinstance(obj, datetime):
-                    return obj.isoformat()
-                elif isinstance(obj, dict):
-                    return {k: convert_objectids(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [convert_objectids(item) for item in obj]
-                else:
-                    return obj
-            
-            return [convert_objectids(doc) for doc in results]
+            # ObjectId/datetime are converted by the BSON decoder itself
+            collection = self.db.get_collection(collection_name, codec_options=QUERY_CODEC_OPTIONS)
+            cursor = collection.find(filter_dict).batch_size(STREAM_BATCH_SIZE).limit(limit)
+            for doc in cursor:
+                yield doc
             
         except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON query: {e}")
@@ -0,0 +1,100 @@
+"""
+Persistent Embedding Cache
+Reuses vectors for text that was already embedded by the same provider/model
+"""
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import column, select, table
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from app.core.config import settings
+from app.services.vector_index import get_engine
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Lightweight handle on the table created by migration 0003
+embedding_cache_table = table(
+    "embedding_cache",
+    column("hash"),
+    column("provider"),
+    column("model"),
+    column("vec", Vector()),
+)
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper backed by the embedding_cache table
+
+    Documents are keyed by (sha256(text), provider, model). Cached vectors
+    are fetched in one SELECT, only the misses are sent to the wrapped
+    embeddings, and the new vectors are written back in one INSERT.
+    Query embeddings use an in-process LRU instead.
+    """
+
+    QUERY_CACHE_SIZE = 1024
+
+    def __init__(self, embeddings: Embeddings, provider: str, model: str,
+                 connection_string: Optional[str] = None):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+        self.connection_string = connection_string or settings.DATABASE_URL
+        self._embed_query_cached = lru_cache(maxsize=self.QUERY_CACHE_SIZE)(self._embed_query)
+
+    def _embed_query(self, text: str) -> Tuple[float, ...]:
+        return tuple(self.embeddings.embed_query(text))
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query, reusing recent results"""
+        return list(self._embed_query_cached(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, only calling the wrapped embeddings for cache misses"""
+        if not texts:
+            return []
+
+        hashes = [hashlib.sha256(text.encode()).digest() for text in texts]
+        vectors = self._load(set(hashes))
+
+        # De-duplicate misses so repeated chunks are embedded once
+        missing = {}
+        for digest, text in zip(hashes, texts):
+            if digest not in vectors:
+                missing.setdefault(digest, text)
+
+        if missing:
+            new_vectors = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} embedded")
+        return [vectors[digest] for digest in hashes]
+
+    def _load(self, hashes: Iterable[bytes]) -> Dict[bytes, List[float]]:
+        t = embedding_cache_table
+        query = select(t.c.hash, t.c.vec).where(
+            t.c.hash.in_(list(hashes)),
+            t.c.provider == self.provider,
+            t.c.model == self.model
+        )
+        try:
+            with get_engine(self.connection_string).connect() as conn:
+                return {bytes(digest): vec.tolist() for digest, vec in conn.execute(query)}
+        except SQLAlchemyError as e:
+            logger.warning(f"Embedding cache lookup failed, embedding all texts: {e}")
+            return {}
+
+    def _store(self, vectors: Dict[bytes, List[float]]):
+        rows = [
+            {"hash": digest, "provider": self.provider, "model": self.model, "vec": vec}
+            for digest, vec in vectors.items()
+        ]
+        try:
+            with get_engine(self.connection_string).begin() as conn:
+                conn.execute(insert(embedding_cache_table).on_conflict_do_nothing(), rows)
+        except SQLAlchemyError as e:
+            logger.warning(f"Failed to store embeddings in cache: {e}")
@@ -2,46 +2,191 @@
 Custom Embeddings class for local embedding service
 Compatible with LangChain's Embeddings interface
 """
-from typing import List
+from typing import Callable, Dict, List
+from concurrent.futures import Future
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from langchain_core.embeddings import Embeddings
 import logging
+import queue
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive connection pool shared by all embedding calls in the process
+_session: requests.Session = None
+_session_lock = threading.Lock()
+
+def _get_session() -> requests.Session:
+    """Get or create the pooled HTTP session for the embedding service"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=3,
+                    backoff_factor=0.2,
+                    status_forcelist=[502, 503, 504],
+                    allowed_methods=["GET", "POST"]  # embedding requests are idempotent
+                )
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=retry)
+                session = requests.Session()
+                session.headers["Accept-Encoding"] = "gzip"
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+class _QueryBatcher:
+    """
+    Coalesces concurrent single-text embedding requests
+    
+    A background thread collects texts submitted within a short window
+    (up to max_batch) and sends them in one /embeddings call, resolving
+    each caller's future with its own vector.
+    """
+    
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]],
+                 max_batch: int = 64, max_wait: float = 0.005):
+        self._embed_fn = embed_fn
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+    
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait
+            
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                embeddings = self._embed_fn([text for text, _ in batch])
+                if len(embeddings) != len(batch):
+                    raise ValueError(
+                        f"Embedding service returned {len(embeddings)} vectors for {len(batch)} texts"
+                    )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+# Bounds for texts per /embeddings request: large enough to amortize the
+# round-trip, small enough to keep one request's payload and encode time sane
+MIN_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 256
+
+# Longest a query waits for its batched embedding: covers the request
+# timeout and its retries, so a stuck batcher fails instead of hanging
+QUERY_TIMEOUT = 150
+
+# Packed response format of the embedding service and its float element types
+BINARY_MEDIA_TYPE = "application/octet-stream"
+FLOAT_DTYPES = {"float32": "<f4", "float16": "<f2"}
+
+# One batcher per service URL, shared by all LocalEmbeddings instances
+_batchers: Dict[str, _QueryBatcher] = {}
+_batchers_lock = threading.Lock()
+
 class LocalEmbeddings(Embeddings):
     """Custom embeddings using local embedding service"""
     
-    def __init__(self, service_url: str = "http://localhost:8001"):
+    def __init__(self, service_url: str = "http://localhost:8001", batch_size: int = 64):
         self.service_url = service_url
+        self.batch_size = min(max(batch_size, MIN_BATCH_SIZE), MAX_BATCH_SIZE)
         self._verify_service()
     
     def _verify_service(self):
         """Verify embedding service is running"""
         try:
-            response = requests.get(f"{self.service_url}/health", timeout=5)
+            response = _get_session().get(f"{self.service_url}/health", timeout=5)
             response.raise_for_status()
-            logger.info(f"Connected to embedding service: {response.json()}")
+            health = response.json()
+            self.model = health.get("model", "unknown")
+            logger.info(f"Connected to embedding service: {health}")
         except Exception as e:
             logger.error(f"Cannot connect to embedding service at {self.service_url}: {e}")
             raise ConnectionError(f"Embedding service unavailable: {e}")
     
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embed a list of documents"""
+    def _get_batcher(self) -> _QueryBatcher:
+        batcher = _batchers.get(self.service_url)
+        if batcher is None:
+            with _batchers_lock:
+                batcher = _batchers.get(self.service_url)
+                if batcher is None:
+                    batcher = _QueryBatcher(self.embed_documents)
+                    _batchers[self.service_url] = batcher
+        return batcher
+    
+    def _request_array(self, texts: List[str]) -> np.ndarray:
+        """POST texts to the embedding service and return an (N, dim) float32 array"""
         try:
-            response = requests.post(
+            response = _get_session().post(
                 f"{self.service_url}/embeddings",
                 json={"texts": texts},
+                headers={"Accept": f"{BINARY_MEDIA_TYPE}, application/json;q=0.5"},
                 timeout=30
             )
             response.raise_for_status()
-            result = response.json()
-            return result["embeddings"]
+            if response.headers.get("Content-Type", "").startswith(BINARY_MEDIA_TYPE):
+                rows, dims = (int(n) for n in response.headers["X-Embedding-Shape"].split(","))
+                dtype = FLOAT_DTYPES[response.headers.get("X-Embedding-Dtype", "float32")]
+                vectors = np.frombuffer(response.content, dtype=dtype).reshape(rows, dims)
+                return vectors.astype(np.float32, copy=False)
+            # Older services only answer with JSON
+            return np.asarray(response.json()["embeddings"], dtype=np.float32)
         except Exception as e:
             logger.error(f"Embedding generation failed: {e}")
             raise
     
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """POST texts to the embedding service and return the raw vectors"""
+        return self._request_array(texts).tolist()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents in batch_size chunks"""
+        if len(texts) <= self.batch_size:
+            return self._request_embeddings(texts) if texts else []
+        
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._request_embeddings(texts[start:start + self.batch_size]))
+        return embeddings
+    
+    def embed_documents_np(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a list of documents as one contiguous (N, dim) float32 array
+        
+        Avoids holding N x dim boxed Python floats for callers that do
+        their own vector math or hand the matrix to a vector index.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate([
+            self._request_array(texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ])
+    
     def embed_query(self, text: str) -> List[float]:
-        """Embed a single query"""
-        embeddings = self.embed_documents([text])
-        return embeddings[0]
+        """Embed a single query, batched with concurrent queries"""
+        return self._get_batcher().submit(text).result(timeout=QUERY_TIMEOUT)
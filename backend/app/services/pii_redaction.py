@@ -3,14 +3,59 @@ PII Detection and Redaction Service
 Uses Microsoft Presidio for enterprise-grade data protection
 """
 
-from typing import List, Dict, Any, Optional, Set
-from presidio_analyzer import AnalyzerEngine
+from typing import Iterable, List, Dict, Any, Optional, Set
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import multiprocessing
+import re
+import threading
+from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine
 from presidio_anonymizer import AnonymizerEngine
 from presidio_anonymizer.entities import OperatorConfig
+from app.core.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+_engine_lock = threading.Lock()
+
+# Pattern-based entities that cannot match without a digit or an "@". NER
+# entities (PERSON, LOCATION, DATE_TIME) are excluded: spaCy tags lowercase
+# text such as "john smith", "paris" or "last week"
+_HINTED_ENTITIES = frozenset({
+    "EMAIL_ADDRESS", "PHONE_NUMBER", "CREDIT_CARD", "US_SSN",
+    "US_BANK_NUMBER", "IBAN_CODE", "IP_ADDRESS"
+})
+_PII_HINT_PATTERN = re.compile(r'[\d@]')
+
+def _may_contain_pii(text: str) -> bool:
+    """Cheap prefilter for _HINTED_ENTITIES: False only when none can match"""
+    return _PII_HINT_PATTERN.search(text) is not None
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Worker pool for large result sets; each worker loads Presidio once"""
+    global _process_pool
+    if _process_pool is None:
+        with _engine_lock:
+            if _process_pool is None:
+                # spawn: forking a process that runs server threads is unsafe
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=settings.PII_REDACTION_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _process_pool
+
+def _redact_in_worker(texts: List[str]) -> List[str]:
+    """Worker-side redaction of one chunk of distinct values"""
+    redactor = create_redactor(use_presidio=True)
+    if isinstance(redactor, PIIRedactor):
+        redacted = redactor._redact_distinct(texts)
+        return [redacted[text] for text in texts]
+    return redactor.redact_many(texts)
+
 class PIIRedactor:
     """
     PII detection and redaction using Microsoft Presidio
@@ -48,6 +93,17 @@ class PIIRedactor:
         "DEFAULT": OperatorConfig("replace", {"new_value": "[REDACTED]"})
     }
     
+    # Distinct cell values remembered by redact_text
+    REDACTION_CACHE_SIZE = 50_000
+    
+    # Distinct values above which redaction is spread over worker processes;
+    # each worker loads its own spaCy/Presidio, so only very large sets qualify
+    PARALLEL_MIN_VALUES = 10_000
+    
+    # Presidio engines shared by all instances
+    _analyzer_singleton = None
+    _anonymizer_singleton = None
+    
     def __init__(self, language: str = "en", entities: Optional[List[str]] = None):
         """
         Initialize PII redactor
@@ -56,17 +112,33 @@ class PIIRedactor:
             language: Language for analysis (default: "en")
             entities: List of PII entities to detect (default: all)
         """
+        # Result sets repeat values heavily (statuses, names, enums)
+        self._redact_cached = lru_cache(maxsize=self.REDACTION_CACHE_SIZE)(self._redact)
+        
         try:
-            self.analyzer = AnalyzerEngine()
-            self.anonymizer = AnonymizerEngine()
+            self.analyzer, self.anonymizer = self._get_engines()
+            self.batch_analyzer = BatchAnalyzerEngine(analyzer_engine=self.analyzer)
             self.language = language
             self.entities = entities or self.DEFAULT_ENTITIES
+            # Skip values without hints only when every entity needs one
+            self._prefilter = _HINTED_ENTITIES.issuperset(self.entities)
             logger.info("PIIRedactor initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Presidio: {e}")
             self.analyzer = None
+            self.batch_analyzer = None
             self.anonymizer = None
     
+    @classmethod
+    def _get_engines(cls):
+        """Load the Presidio engines (and spaCy model) once per process"""
+        if cls._analyzer_singleton is None:
+            with _engine_lock:
+                if cls._analyzer_singleton is None:
+                    cls._anonymizer_singleton = AnonymizerEngine()
+                    cls._analyzer_singleton = AnalyzerEngine()
+        return cls._analyzer_singleton, cls._anonymizer_singleton
+    
     def redact_text(self, text: str) -> str:
         """
         Redact PII from text
@@ -77,59 +149,121 @@ class PIIRedactor:
         Returns:
             Text with PII redacted
         """
-        if not self.analyzer or not text:
+        if not self.analyzer or not text or not self._may_contain_pii(text):
             return text
         
         try:
-            # Analyze text for PII
-            results = self.analyzer.analyze(
-                text=text,
-                language=self.language,
-                entities=self.entities
-            )
-            
-            if not results:
-                return text
-            
-            # Anonymize detected entities
-            anonymized = self.anonymizer.anonymize(
-                text=text,
-                analyzer_results=results,
-                operators=self.REDACTION_OPERATORS
-            )
-            
-            return anonymized.text
-            
+            return self._redact_cached(text)
         except Exception as e:
             logger.error(f"Redaction failed: {e}")
             return text
     
-    def redact_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _may_contain_pii(self, text: str) -> bool:
+        """False only when the configured entities cannot match text"""
+        return not self._prefilter or _may_contain_pii(text)
+    
+    def _redact(self, text: str) -> str:
+        """Analyze and anonymize one text; raises on failure so errors aren't cached"""
+        results = self.analyzer.analyze(
+            text=text,
+            language=self.language,
+            entities=self.entities
+        )
+        
+        if not results:
+            return text
+        
+        return self._anonymize(text, results)
+    
+    def _anonymize(self, text: str, analyzer_results: List[Any]) -> str:
+        """Replace detected entities with their redaction labels"""
+        return self.anonymizer.anonymize(
+            text=text,
+            analyzer_results=analyzer_results,
+            operators=self.REDACTION_OPERATORS
+        ).text
+    
+    def redact_results(self, results: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Redact PII from query results
         
         Args:
-            results: List of result dictionaries
+            results: Result dictionaries (list or streaming iterator)
             
         Returns:
             Results with PII redacted
         """
+        results = list(results)
         if not self.analyzer or not results:
             return results
         
-        redacted_results = []
+        redacted_results = [dict(row) for row in results]
+        
+        cells = [
+            (i, key, value)
+            for i, row in enumerate(results)
+            for key, value in row.items()
+            if isinstance(value, str) and value and self._may_contain_pii(value)
+        ]
+        
+        # Analyze each distinct value once
+        distinct = list(dict.fromkeys(value for _, _, value in cells))
+        if settings.PII_REDACTION_WORKERS > 0 and len(distinct) >= self.PARALLEL_MIN_VALUES:
+            redacted = self._redact_distinct_parallel(distinct)
+        else:
+            redacted = self._redact_distinct(distinct)
         
-        for row in results:
-            redacted_row = {}
-            for key, value in row.items():
-                if isinstance(value, str):
-                    redacted_row[key] = self.redact_text(value)
-                else:
-                    redacted_row[key] = value
-            redacted_results.append(redacted_row)
+        for i, key, value in cells:
+            redacted_results[i][key] = redacted[value]
         
         return redacted_results
     
+    def _redact_distinct(self, distinct: List[str]) -> Dict[str, str]:
+        """Redact distinct values in one batch (single NLP pipeline pass)"""
+        redacted = {}
+        
+        try:
+            analyses = self._analyze_batch(distinct)
+        except Exception as e:
+            logger.error(f"Batch redaction failed, redacting value by value: {e}")
+            return {value: self.redact_text(value) for value in distinct}
+        
+        for value, analyzer_results in zip(distinct, analyses):
+            redacted[value] = value
+            if not analyzer_results:
+                continue
+            try:
+                redacted[value] = self._anonymize(value, analyzer_results)
+            except Exception as e:
+                logger.error(f"Redaction failed: {e}")
+        
+        return redacted
+    
+    def _redact_distinct_parallel(self, distinct: List[str]) -> Dict[str, str]:
+        """Split large value sets across the worker processes"""
+        pool = _get_process_pool()
+        chunk_size = -(-len(distinct) // settings.PII_REDACTION_WORKERS)
+        chunks = [distinct[i:i + chunk_size] for i in range(0, len(distinct), chunk_size)]
+        
+        try:
+            redacted = {}
+            for chunk, chunk_redacted in zip(chunks, pool.map(_redact_in_worker, chunks)):
+                redacted.update(zip(chunk, chunk_redacted))
+            return redacted
+        except Exception as e:
+            logger.error(f"Parallel redaction failed, redacting in process: {e}")
+            return self._redact_distinct(distinct)
+    
+    def _analyze_batch(self, texts: List[str]) -> List[List[Any]]:
+        """Run the analyzer over many texts with batched NLP processing"""
+        if not texts:
+            return []
+        return self.batch_analyzer.analyze_iterator(
+            texts,
+            language=self.language,
+            entities=self.entities
+        )
+    
     def detect_pii(self, text: str) -> List[Dict[str, Any]]:
         """
         Detect PII in text without redacting
@@ -201,13 +335,22 @@ class PIIRedactor:
         """
         stats = {}
         
-        for row in results:
-            for value in row.values():
-                if isinstance(value, str):
-                    detected = self.detect_pii(value)
-                    for entity in detected:
-                        entity_type = entity["entity_type"]
-                        stats[entity_type] = stats.get(entity_type, 0) + 1
+        if not self.analyzer or not results:
+            return stats
+        
+        texts = [
+            value
+            for row in results
+            for value in row.values()
+            if isinstance(value, str) and value
+        ]
+        
+        try:
+            for detected in self._analyze_batch(texts):
+                for result in detected:
+                    stats[result.entity_type] = stats.get(result.entity_type, 0) + 1
+        except Exception as e:
+            logger.error(f"PII detection failed: {e}")
         
         return stats
 
@@ -225,8 +368,17 @@ class SimplePIIRedactor:
         'IP_ADDRESS': r'\b(?:\d{1,3}\.){3}\d{1,3}\b'
     }
     
+    # All patterns as one alternation of named groups: a single scan per
+    # string, with the matching group name giving the entity label
+    FUSED_PATTERN = re.compile(
+        '|'.join(f'(?P<{name}>{pattern})' for name, pattern in PATTERNS.items())
+    )
+    
+    # Joins cell values so a whole result set is scanned in one regex pass;
+    # none of the patterns can match across it
+    SEPARATOR = '\x00'
+    
     def __init__(self):
-        import re
         self.compiled_patterns = {
             name: re.compile(pattern) 
             for name, pattern in self.PATTERNS.items()
@@ -237,30 +389,57 @@ class SimplePIIRedactor:
         if not text:
             return text
         
-        redacted = text
-        for entity_type, pattern in self.compiled_patterns.items():
-            redacted = pattern.sub(f'[{entity_type}]', redacted)
+        return self.FUSED_PATTERN.sub(_entity_label, text)
+    
+    def redact_many(self, texts: List[str]) -> List[str]:
+        """Redact a batch of strings with a single regex pass over all of them"""
+        if not texts:
+            return []
         
-        return redacted
+        joined = self.SEPARATOR.join(texts)
+        if joined.count(self.SEPARATOR) != len(texts) - 1:
+            # A value contains the separator itself; redact one by one
+            return [self.redact_text(text) for text in texts]
+        
+        return self.FUSED_PATTERN.sub(_entity_label, joined).split(self.SEPARATOR)
     
-    def redact_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Redact PII from results"""
-        redacted_results = []
-        
-        for row in results:
-            redacted_row = {}
-            for key, value in row.items():
-                if isinstance(value, str):
-                    redacted_row[key] = self.redact_text(value)
-                else:
-                    redacted_row[key] = value
-            redacted_results.append(redacted_row)
+    def redact_results(self, results: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Redact PII from results (list or streaming iterator)"""
+        results = list(results)
+        redacted_results = [dict(row) for row in results]
+        
+        cells = [
+            (i, key, value)
+            for i, row in enumerate(results)
+            for key, value in row.items()
+            if isinstance(value, str)
+        ]
+        distinct = list(dict.fromkeys(value for _, _, value in cells))
+        redacted = dict(zip(distinct, self.redact_many(distinct)))
+        
+        for i, key, value in cells:
+            redacted_results[i][key] = redacted[value]
         
         return redacted_results
+    
+    def get_stats(self, results: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Count detected entities by type across all string cells"""
+        joined = self.SEPARATOR.join(
+            value
+            for row in results
+            for value in row.values()
+            if isinstance(value, str)
+        )
+        return dict(Counter(match.lastgroup for match in self.FUSED_PATTERN.finditer(joined)))
+
+def _entity_label(match: re.Match) -> str:
+    """Replacement for a FUSED_PATTERN match, e.g. [EMAIL_ADDRESS]"""
+    return f'[{match.lastgroup}]'
 
 # Factory function
+@lru_cache(maxsize=None)
 def create_redactor(use_presidio: bool = True) -> PIIRedactor:
-    """Create PII redactor"""
+    """Get the process-wide PII redactor"""
     if use_presidio:
         redactor = PIIRedactor()
         if redactor.analyzer:
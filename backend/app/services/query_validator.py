@@ -4,13 +4,19 @@ Defense-in-depth security with comprehensive validation
 """
 
 import sqlparse
+from sqlparse.sql import Statement
 import logging
-from typing import List, Set, Tuple, Optional
+import re
+from typing import FrozenSet, List, Set, Tuple, Optional
 from dataclasses import dataclass
+from functools import lru_cache
 from enum import Enum
 
 logger = logging.getLogger(__name__)
 
+# Resolved once instead of via sqlparse.tokens attribute lookups per token
+NAME_TOKEN = sqlparse.tokens.Name
+
 class ValidationError(Enum):
     INVALID_SYNTAX = "invalid_syntax"
     FORBIDDEN_OPERATION = "forbidden_operation"
@@ -20,7 +26,7 @@ class ValidationError(Enum):
     MULTIPLE_STATEMENTS = "multiple_statements"
     MISSING_LIMIT = "missing_limit"
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ValidationResult:
     is_valid: bool
     errors: List[str]
@@ -29,11 +35,11 @@ class ValidationResult:
     
 class QueryValidator:
     """
-    Multi-layer query validation:
-    1. SQL syntax parsing (AST)
+    Multi-layer query validation, cheapest layers first:
+    1. Injection pattern detection
     2. Forbidden operation detection
-    3. Table/column whitelist validation
-    4. Injection pattern detection
+    3. SQL syntax parsing (AST), only when a later layer needs it
+    4. Table/column whitelist validation
     """
     
     # Allowed SQL statement types
@@ -56,17 +62,73 @@ class QueryValidator:
         r'OR\s+\'\w+\'\s*=\s*\'\w+\'',  # OR-based injection
     ]
     
+    # MongoDB operators that write or drop data
+    DANGEROUS_MONGO_OPS = frozenset({'$merge', '$out', '$update', '$delete', '$drop'})
+    
+    # Compiled once at class load
+    FORBIDDEN_REGEX = re.compile(
+        r'\b(?:' + '|'.join(map(re.escape, sorted(FORBIDDEN_KEYWORDS))) + r')\b',
+        re.IGNORECASE
+    )
+    # Forbidden keywords and LIMIT found in the same single pass
+    KEYWORD_SCAN_REGEX = re.compile(
+        r'\b(?:(?P<forbidden>' + '|'.join(map(re.escape, sorted(FORBIDDEN_KEYWORDS))) + r')|(?P<limit>LIMIT))\b',
+        re.IGNORECASE
+    )
+    LIMIT_REGEX = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+    # One alternation scanned in a single pass; group N+1 is DANGEROUS_PATTERNS[N]
+    DANGEROUS_REGEX = re.compile(
+        '|'.join(f'({pattern})' for pattern in DANGEROUS_PATTERNS),
+        re.IGNORECASE
+    )
+    READ_ONLY_START_REGEX = re.compile(
+        r'\s*(?:' + '|'.join(sorted(ALLOWED_STATEMENTS)) + r')\b',
+        re.IGNORECASE
+    )
+    
     def __init__(self, allowed_tables: Optional[Set[str]] = None, 
                  allowed_columns: Optional[Set[str]] = None):
         self.allowed_tables = allowed_tables or set()
         self.allowed_columns = allowed_columns or set()
     
+    # Whitelists are matched case-insensitively against lowered copies built
+    # on assignment (assign a new set rather than mutating it in place)
+    
+    @property
+    def allowed_tables(self) -> Set[str]:
+        return self._allowed_tables
+    
+    @allowed_tables.setter
+    def allowed_tables(self, tables: Set[str]):
+        self._allowed_tables = tables
+        self._allowed_tables_lower = frozenset(t.lower() for t in tables)
+    
+    @property
+    def allowed_columns(self) -> Set[str]:
+        return self._allowed_columns
+    
+    @allowed_columns.setter
+    def allowed_columns(self, columns: Set[str]):
+        self._allowed_columns = columns
+        self._allowed_columns_lower = frozenset(c.lower() for c in columns)
+    
     def validate(self, query: str, db_type: str = "postgresql") -> ValidationResult:
         """
         Comprehensive query validation
         
-        Returns ValidationResult with status, errors, and normalized query
+        Returns ValidationResult with status, errors, and normalized query.
+        Results are cached per (query, db_type, table whitelist) and shared
+        between callers, so they must not be modified.
         """
+        return _validate_cached((query or "").strip(), db_type, self._allowed_tables_lower)
+    
+    @staticmethod
+    def clear_cache():
+        """Drop all cached validation results"""
+        _validate_cached.cache_clear()
+    
+    def _validate(self, query: str, db_type: str) -> ValidationResult:
+        """Uncached validation behind validate()"""
         errors = []
         warnings = []
         
@@ -80,58 +142,54 @@ class QueryValidator:
         
         query = query.strip()
         
-        # Layer 1: SQL Syntax Validation
-        try:
-            parsed = sqlparse.parse(query)
-            if not parsed:
-                errors.append("Failed to parse SQL query")
-                return ValidationResult(False, errors, warnings, query)
-            
-            # Check for multiple statements
-            if len(parsed) > 1:
-                errors.append("Multiple SQL statements detected. Only single statements allowed.")
-                return ValidationResult(False, errors, warnings, query)
-            
-            statement = parsed[0]
-            
-        except Exception as e:
-            logger.error(f"SQL parsing error: {e}")
-            errors.append(f"Invalid SQL syntax: {str(e)}")
-            return ValidationResult(False, errors, warnings, query)
+        # Cheap regex layers run first so rejected queries never reach sqlparse
         
-        # Layer 2: Statement Type Validation
-        first_token = self._get_first_keyword(statement)
-        if not first_token:
-            errors.append("Could not identify SQL statement type")
+        # Layer 1: Injection Pattern Detection
+        dangerous = self.DANGEROUS_REGEX.search(query)
+        if dangerous:
+            pattern = self.DANGEROUS_PATTERNS[dangerous.lastindex - 1]
+            errors.append(f"Potential SQL injection pattern detected: {pattern}")
             return ValidationResult(False, errors, warnings, query)
         
-        if first_token.upper() not in self.ALLOWED_STATEMENTS:
-            errors.append(f"Forbidden SQL operation: {first_token}. Only read-only queries allowed.")
-            return ValidationResult(False, errors, warnings, query)
+        # Layer 2: Forbidden Keyword Scan (also notes LIMIT for layer 6)
+        has_limit = False
+        for keyword in self.KEYWORD_SCAN_REGEX.finditer(query):
+            if keyword.lastgroup == 'forbidden':
+                errors.append(f"Query contains forbidden keyword: {keyword.group().upper()}")
+                return ValidationResult(False, errors, warnings, query)
+            has_limit = True
         
-        # Layer 3: Forbidden Keyword Scan
-        query_upper = query.upper()
-        for forbidden in self.FORBIDDEN_KEYWORDS:
-            if forbidden in query_upper:
-                errors.append(f"Query contains forbidden keyword: {forbidden}")
+        # Layer 3: SQL Syntax Validation, only when a later layer needs the AST
+        # (statement type not evident from the prefix, a possible second
+        # statement, or a table whitelist)
+        starts_read_only = self.READ_ONLY_START_REGEX.match(query) is not None
+        statement = None
+        if not starts_read_only or ';' in query[:-1] or self.allowed_tables:
+            statement, error = self._parse_statement(query)
+            if error:
+                errors.append(error)
                 return ValidationResult(False, errors, warnings, query)
         
-        # Layer 4: Injection Pattern Detection
-        import re
-        for pattern in self.DANGEROUS_PATTERNS:
-            if re.search(pattern, query, re.IGNORECASE):
-                errors.append(f"Potential SQL injection pattern detected: {pattern}")
+        # Layer 4: Statement Type Validation
+        if not starts_read_only:
+            first_token = self._get_first_keyword(statement)
+            if not first_token:
+                errors.append("Could not identify SQL statement type")
+                return ValidationResult(False, errors, warnings, query)
+            
+            if first_token.upper() not in self.ALLOWED_STATEMENTS:
+                errors.append(f"Forbidden SQL operation: {first_token}. Only read-only queries allowed.")
                 return ValidationResult(False, errors, warnings, query)
         
         # Layer 5: Table/Column Validation (if whitelist provided)
         if self.allowed_tables:
             referenced_tables = self._extract_tables(statement)
             for table in referenced_tables:
-                if table.lower() not in {t.lower() for t in self.allowed_tables}:
+                if table.lower() not in self._allowed_tables_lower:
                     errors.append(f"Table not in whitelist: {table}")
         
         # Layer 6: LIMIT Check (warning only)
-        if 'LIMIT' not in query_upper:
+        if not has_limit:
             warnings.append("Query missing LIMIT clause. May return large result sets.")
         
         # Normalize query
@@ -146,6 +204,23 @@ class QueryValidator:
         
         return ValidationResult(is_valid, errors, warnings, normalized)
     
+    def _parse_statement(self, query: str) -> Tuple[Optional[Statement], Optional[str]]:
+        """Parse a single SQL statement, returning (statement, error)"""
+        try:
+            parsed = sqlparse.parse(query)
+        except Exception as e:
+            logger.error(f"SQL parsing error: {e}")
+            return None, f"Invalid SQL syntax: {str(e)}"
+        
+        if not parsed:
+            return None, "Failed to parse SQL query"
+        
+        # Check for multiple statements
+        if len(parsed) > 1:
+            return None, "Multiple SQL statements detected. Only single statements allowed."
+        
+        return parsed[0], None
+    
     def validate_mongodb_query(self, query: dict) -> ValidationResult:
         """
         Validate MongoDB query object
@@ -157,25 +232,23 @@ class QueryValidator:
             errors.append("MongoDB query must be a dictionary")
             return ValidationResult(False, errors, warnings, str(query))
         
-        # Check for dangerous operations
-        dangerous_ops = {'$merge', '$out', '$update', '$delete', '$drop'}
-        query_str = str(query)
-        
-        for op in dangerous_ops:
-            if op in query_str:
-                errors.append(f"Forbidden MongoDB operation: {op}")
+        # Check for dangerous operations (walks keys; no repr of the query)
+        op = _find_mongo_operator(query, self.DANGEROUS_MONGO_OPS)
+        if op:
+            errors.append(f"Forbidden MongoDB operation: {op}")
+            return ValidationResult(False, errors, warnings, "")
         
         # Check for collection
         if 'collection' not in query:
             warnings.append("No collection specified in query")
         
-        is_valid = len(errors) == 0
-        return ValidationResult(is_valid, errors, warnings, query_str)
+        return ValidationResult(True, errors, warnings, str(query))
     
     def _get_first_keyword(self, statement) -> Optional[str]:
         """Extract first keyword from SQL statement"""
         for token in statement.tokens:
-            if token.ttype is not None and token.ttype in sqlparse.tokens.Keyword:
+            # is_keyword is precomputed by sqlparse when the token is created
+            if token.is_keyword:
                 return token.value
             elif token.ttype is None and token.is_group:
                 # Handle WITH clause (CTE)
@@ -187,54 +260,64 @@ class QueryValidator:
     def _extract_tables(self, statement) -> Set[str]:
         """Extract table names from SQL statement"""
         tables = set()
+        name_token = NAME_TOKEN
         
-        def process_token(token):
+        # Iterative walk over the token tree (no per-node Python frames)
+        stack = list(statement.tokens)
+        while stack:
+            token = stack.pop()
             if token.ttype is None and token.is_group:
                 # Check if it's a table reference
-                if len(token.tokens) >= 1:
+                if token.tokens:
                     first = token.token_first()
-                    if first and first.ttype in sqlparse.tokens.Name:
+                    if first and first.ttype in name_token:
                         tables.add(first.value)
-                # Recurse into sub-tokens
-                for sub in token.tokens:
-                    process_token(sub)
-            elif token.ttype in sqlparse.tokens.Name:
+                # Descend into sub-tokens
+                stack.extend(token.tokens)
+            elif token.ttype in name_token:
                 tables.add(token.value)
         
-        for token in statement.tokens:
-            process_token(token)
-        
         return tables
     
     def is_read_only(self, query: str) -> bool:
         """Quick check if query is read-only"""
-        query_upper = query.upper().strip()
-        
         # Must start with allowed keywords
-        if not any(query_upper.startswith(kw) for kw in self.ALLOWED_STATEMENTS):
+        if not self.READ_ONLY_START_REGEX.match(query):
             return False
         
         # Must not contain forbidden keywords
-        for forbidden in self.FORBIDDEN_KEYWORDS:
-            if forbidden in query_upper:
-                return False
-        
-        return True
+        return self.FORBIDDEN_REGEX.search(query) is None
     
     def add_safety_limit(self, query: str, max_rows: int = 100) -> str:
         """Add safety LIMIT if not present"""
-        query_upper = query.upper()
-        
-        if 'LIMIT' in query_upper:
+        if self.LIMIT_REGEX.search(query):
             return query
         
         # Remove trailing semicolon if present
-        query = query.rstrip()
-        if query.endswith(';'):
-            query = query[:-1]
+        query = query.rstrip().removesuffix(';')
         
         return f"{query} LIMIT {max_rows}"
 
+def _find_mongo_operator(obj, operators: FrozenSet[str]) -> Optional[str]:
+    """Return the first key in a nested query that is one of operators"""
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key in operators:
+                return key
+            found = _find_mongo_operator(value, operators)
+            if found:
+                return found
+    elif isinstance(obj, list):
+        for item in obj:
+            found = _find_mongo_operator(item, operators)
+            if found:
+                return found
+    return None
+
+@lru_cache(maxsize=4096)
+def _validate_cached(query: str, db_type: str, allowed_tables: FrozenSet[str]) -> ValidationResult:
+    return QueryValidator(allowed_tables=set(allowed_tables))._validate(query, db_type)
+
 # Convenience function
 def validate_query(query: str, db_type: str = "postgresql", 
                    allowed_tables: Optional[Set[str]] = None) -> ValidationResult:
@@ -6,25 +6,33 @@ Enhanced RAG Service with Critical Fixes
 - Optimized prompts
 """
 
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Iterator, List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import PGVector
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import Retrying, retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from app.core.config import settings
 from app.core.prompts import get_query_generation_prompt, get_rag_qa_prompt
 from app.utils.query_cleaner import clean_query, QueryCleaner
 from app.services.query_validator import QueryValidator
 from app.services.local_embeddings import LocalEmbeddings
-import json
 import logging
+import orjson
+import threading
 import time
 
 logger = logging.getLogger(__name__)
 
+# Chat model used when llm_config doesn't name one; unknown providers use OpenAI
+DEFAULT_MODELS = {
+    'google': "gemini-1.5-flash",
+    'openrouter': "openai/gpt-3.5-turbo",
+    'openai': "gpt-3.5-turbo",
+}
+
 class RAGService:
     """
     Enhanced RAG Service with production-ready features
@@ -37,11 +45,15 @@ class RAGService:
     5. Enhanced error handling
     """
     
+    # Texts per embed_documents request, and how many requests run at once
+    EMBEDDING_BATCH_SIZE = 64
+    EMBEDDING_CONCURRENCY = 4
+    
     def __init__(self, llm_config: Dict[str, Any] = None):
         self.llm_config = llm_config or {}
         self.provider = self.llm_config.get('provider', 'openai')
         self.api_key = self.llm_config.get('api_key') or settings.OPENAI_API_KEY
-        self.model = self.llm_config.get('model')
+        self.model = self.llm_config.get('model') or DEFAULT_MODELS.get(self.provider, DEFAULT_MODELS['openai'])
         
         # Initialize components
         self.embeddings = self._initialize_embeddings()
@@ -118,9 +130,8 @@ class RAGService:
         """Initialize LLM with timeout and retry configuration"""
         try:
             if self.provider == 'google':
-                model = self.model or "gemini-1.5-flash"
                 return ChatGoogleGenerativeAI(
-                    model=model,
+                    model=self.model,
                     google_api_key=self.api_key,
                     temperature=0,
                     convert_system_message_to_human=True,
@@ -129,9 +140,8 @@ class RAGService:
                 )
             
             elif self.provider == 'openrouter':
-                model = self.model or "openai/gpt-3.5-turbo"
                 return ChatOpenAI(
-                    model=model,
+                    model=self.model,
                     temperature=0,
                     openai_api_key=self.api_key,
                     base_url="https://openrouter.ai/api/v1",
@@ -144,9 +154,8 @@ class RAGService:
                 )
             
             else:  # openai
-                model = self.model or "gpt-3.5-turbo"
                 return ChatOpenAI(
-                    model=model,
+                    model=self.model,
                     temperature=0,
                     openai_api_key=self.api_key,
                     request_timeout=30,
@@ -175,6 +184,32 @@ class RAGService:
             logger.warning(f"LLM invocation failed: {e}. Retrying...")
             raise
     
+    def _stream_llm(self, prompt: str) -> Iterator[str]:
+        """
+        Stream LLM output as it is generated
+        
+        Opening the stream (up to the first chunk) is retried like
+        _invoke_llm_with_retry; a failure mid-stream is not retried since
+        part of the answer has already been sent.
+        """
+        start_time = time.time()
+        for attempt in Retrying(
+            stop=stop_after_attempt(3),
+            wait=wait_exponential(multiplier=1, min=2, max=10),
+            reraise=True
+        ):
+            with attempt:
+                chunks = self.llm.stream(prompt)
+                first = next(chunks, None)
+        
+        if first is None:
+            return
+        logger.info(f"LLM first token after {time.time() - start_time:.2f}s")
+        
+        yield first.content
+        for chunk in chunks:
+            yield chunk.content
+    
     def create_vector_store(self, connection_id: int, schema: Dict[str, Any], sample_data: List[Dict]):
         """Create vector store from database schema and sample data"""
         try:
@@ -182,26 +217,31 @@ class RAGService:
             
             # Add schema information
             for table_name, columns in schema.items():
-                if isinstance(columns, list):
-                    col_strs = [f"{col['name']} ({col['type']})" for col in columns]
-                else:
-                    col_strs = [f"{col['name']} ({col['type']})" for col in columns.get('fields', [])]
-                
-                schema_text = f"Table: {table_name}\nColumns: {', '.join(col_strs)}"
-                documents.append(schema_text)
+                fields = columns if isinstance(columns, list) else columns.get('fields', [])
+                col_strs = ', '.join([f"{col['name']} ({col['type']})" for col in fields])
+                documents.append(f"Table: {table_name}\nColumns: {col_strs}")
             
             # Add sample data
-            for item in sample_data[:50]:  # Limit sample data
-                documents.append(json.dumps(item, indent=2, default=str))
+            dumps = orjson.dumps
+            option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+            documents.extend([
+                dumps(item, default=str, option=option).decode()
+                for item in sample_data[:50]  # Limit sample data
+            ])
             
             # Split documents
             texts = self.text_splitter.create_documents(documents)
             
-            # Create vector store
+            # Embed in capped batches, several requests in flight at once
+            contents = [doc.page_content for doc in texts]
+            vectors = self._embed_concurrently(contents)
+            
+            # Create vector store from the precomputed embeddings
             collection_name = f"connection_{connection_id}"
-            vector_store = PGVector.from_documents(
-                documents=texts,
+            vector_store = PGVector.from_embeddings(
+                text_embeddings=list(zip(contents, vectors)),
                 embedding=self.embeddings,
+                metadatas=[doc.metadata for doc in texts],
                 collection_name=collection_name,
                 connection_string=settings.DATABASE_URL
             )
@@ -213,19 +253,27 @@ class RAGService:
             logger.error(f"Failed to create vector store: {e}")
             raise
     
+    def _embed_concurrently(self, contents: List[str]) -> List[List[float]]:
+        """Embed texts in batches, overlapping the network round-trips"""
+        batches = [
+            contents[start:start + self.EMBEDDING_BATCH_SIZE]
+            for start in range(0, len(contents), self.EMBEDDING_BATCH_SIZE)
+        ]
+        if len(batches) <= 1:
+            return self.embeddings.embed_documents(contents) if contents else []
+        
+        vectors = []
+        with ThreadPoolExecutor(max_workers=self.EMBEDDING_CONCURRENCY) as executor:
+            # map() yields results in batch order
+            for batch_vectors in executor.map(self.embeddings.embed_documents, batches):
+                vectors.extend(batch_vectors)
+        return vectors
+    
     def query_with_rag(self, user_query: str, connection_id: int) -> str:
         """Query using RAG with optimized retrieval"""
         try:
             start_time = time.time()
             
-            # Load vector store
-            collection_name = f"connection_{connection_id}"
-            vector_store = PGVector(
-                collection_name=collection_name,
-                connection_string=settings.DATABASE_URL,
-                embedding_function=self.embeddings
-            )
-            
             # Create optimized prompt
             prompt = get_rag_qa_prompt(
                 context="",
@@ -233,14 +281,6 @@ class RAGService:
                 question=user_query
             )
             
-            # Create QA chain with increased retrieval
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=vector_store.as_retriever(search_kwargs={"k": 5}),
-                return_source_documents=False
-            )
-            
             # Execute with retry
             result = self._invoke_llm_with_retry(prompt)
             
@@ -253,6 +293,24 @@ class RAGService:
             logger.error(f"RAG query failed: {e}")
             return f"I encountered an error: {str(e)}. Please try again or check your connection."
     
+    def stream_query_with_rag(self, user_query: str, connection_id: int) -> Iterator[str]:
+        """Like query_with_rag, but yields the answer incrementally"""
+        prompt = get_rag_qa_prompt(
+            context="",
+            schema="",
+            question=user_query
+        )
+        
+        started = False
+        try:
+            for text in self._stream_llm(prompt):
+                started = True
+                yield text
+        except Exception as e:
+            logger.error(f"RAG stream failed: {e}")
+            if not started:
+                yield f"I encountered an error: {str(e)}. Please try again or check your connection."
+    
     def generate_query(self, user_intent: str, schema: Dict[str, Any], 
                        db_type: str, max_retries: int = 2) -> Tuple[str, bool]:
         """
@@ -268,7 +326,7 @@ class RAGService:
             # Generate optimized prompt
             prompt = get_query_generation_prompt(
                 db_type=db_type,
-                schema=json.dumps(schema, indent=2),
+                schema=orjson.dumps(schema, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode(),
                 user_query=user_intent,
                 relationships=relationships
             )
@@ -307,16 +365,32 @@ class RAGService:
     def _extract_relationships(self, schema: Dict[str, Any]) -> str:
         """Extract table relationships from schema metadata"""
         relationships = []
+        append = relationships.append
         
         for table_name, columns in schema.items():
             if isinstance(columns, list):
                 for col in columns:
-                    if col.get('foreign_key'):
-                        fk = col['foreign_key']
-                        rel = f"{table_name}.{col['name']} → {fk.get('referred_table')}.{fk.get('referred_columns', ['id'])[0]}"
-                        relationships.append(rel)
+                    fk = col.get('foreign_key')
+                    if fk:
+                        append(f"{table_name}.{col['name']} → {fk.get('referred_table')}.{fk.get('referred_columns', ['id'])[0]}")
         
         return "\n".join(relationships) if relationships else "No explicit relationships defined."
 
+_rag_service_lock = threading.Lock()
+
+@lru_cache(maxsize=16)
+def _get_cached_rag_service(provider: str, api_key: Optional[str], model: Optional[str]) -> RAGService:
+    return RAGService({'provider': provider, 'api_key': api_key, 'model': model})
+
+def get_rag_service(llm_config: Optional[Dict[str, Any]] = None) -> RAGService:
+    """Get the RAG service shared by all callers with the same provider/key/model"""
+    config = llm_config or {}
+    with _rag_service_lock:
+        return _get_cached_rag_service(
+            config.get('provider', 'openai'),
+            config.get('api_key'),
+            config.get('model')
+        )
+
 # Backward compatibility - alias for existing code
 EnhancedRAGService = RAGService
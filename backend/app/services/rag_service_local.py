@@ -4,23 +4,47 @@ RAG Service with Self-Hosted Models
 - Local LLM via Ollama
 - No external API dependencies
 - Optimized for performance
+
+Ollama only overlaps concurrent generate calls when the server is started
+with OLLAMA_NUM_PARALLEL > 1 (requests per loaded model) and enough
+OLLAMA_MAX_LOADED_MODELS to keep the model resident; otherwise the async
+batch entry points below are queued server-side and run one at a time.
 """
 from typing import List, Dict, Any
+from functools import lru_cache
 from langchain_community.llms import Ollama
+from ollama import AsyncClient
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import PGVector
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
+from langchain_core.documents import Document
 from app.core.config import settings
+from app.core.executor import executor
 from app.services.local_embeddings import LocalEmbeddings
-import json
+from app.services.embedding_cache import CachedEmbeddings
+from app.services.vector_index import IndexedPGVector, ensure_hnsw_index, get_vector_store
+from app.services.retrieval_cache import RetrievalCache
+import orjson
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import requests
+import threading
 import time
 
 logger = logging.getLogger(__name__)
 
+RAG_PROMPT_TEMPLATE = """You are a database assistant. Answer concisely using the context below.
+
+Context: {context}
+
+Question: {question}
+
+Instructions:
+- Be direct and concise
+- For SQL queries, use proper PostgreSQL syntax
+- If suggesting a query, format it clearly
+- Limit response to essential information
+
+Answer:"""
+
 class LocalRAGService:
     """RAG Service using completely self-hosted models with performance optimizations"""
     
@@ -42,26 +66,42 @@ class LocalRAGService:
         
         # Initialize local embeddings
         try:
-            self.embeddings = LocalEmbeddings(service_url=embedding_service_url)
+            local_embeddings = LocalEmbeddings(
+                service_url=embedding_service_url,
+                batch_size=settings.EMBEDDING_BATCH_SIZE
+            )
+            # Re-indexing a connection only embeds chunks that changed
+            self.embeddings = CachedEmbeddings(
+                local_embeddings,
+                provider="local",
+                model=local_embeddings.model
+            )
             logger.info("✓ Local embeddings initialized")
         except Exception as e:
             logger.error(f"Failed to initialize embeddings: {e}")
             raise
         
         # Initialize Ollama LLM with performance settings
+        self.ollama_model = ollama_model
+        self.llm_options = {
+            "temperature": 0,
+            "num_predict": 512,  # Limit response length for faster generation
+            "top_k": 10,  # Reduce sampling space for speed
+            "top_p": 0.9,
+            "repeat_penalty": 1.1
+        }
+        self.ollama_base_url = ollama_base_url
+        self._llm = None
         try:
-            self.llm = Ollama(
-                base_url=ollama_base_url,
-                model=ollama_model,
-                temperature=0,
-                num_predict=512,  # Limit response length for faster generation
-                top_k=10,  # Reduce sampling space for speed
-                top_p=0.9,
-                repeat_penalty=1.1
-            )
-            # Test connection
-            test_response = self.llm.invoke("test")
-            logger.info(f"✓ Ollama LLM initialized with model: {ollama_model}")
+            # Liveness probe only; a test generation would cost a full forward pass
+            response = requests.get(f"{ollama_base_url}/api/tags", timeout=2)
+            response.raise_for_status()
+            available = {m.get("name", "").split(":")[0] for m in response.json().get("models", [])}
+            if ollama_model.split(":")[0] not in available:
+                logger.warning(f"Ollama model {ollama_model} not pulled yet; first request will fail until it is")
+            # Non-blocking client for the async entry points
+            self.aclient = AsyncClient(host=ollama_base_url)
+            logger.info(f"✓ Ollama reachable, using model: {ollama_model}")
         except Exception as e:
             logger.error(f"Failed to initialize Ollama: {e}")
             raise
@@ -72,11 +112,38 @@ class LocalRAGService:
             chunk_overlap=100
         )
         
-        # Thread pool for concurrent operations
-        self.executor = ThreadPoolExecutor(max_workers=3)
+        # Shared pool (RAG_THREAD_POOL_SIZE) for blocking vector store calls
+        self.executor = executor
+        # Recent retrievals per (connection, k, normalized query)
+        self._retrieval_cache = RetrievalCache()
         
         logger.info("Local RAG Service ready")
     
+    @property
+    def llm(self) -> Ollama:
+        """LangChain Ollama client, created on first use"""
+        if self._llm is None:
+            self._llm = Ollama(
+                base_url=self.ollama_base_url,
+                model=self.ollama_model,
+                **self.llm_options
+            )
+        return self._llm
+    
+    @staticmethod
+    def _format_table(table_name: str, columns: List[Dict]) -> str:
+        """Describe a table and its key columns for embedding"""
+        col_strs = []
+        for col in columns:
+            col_str = f"{col['name']} ({col['type']})"
+            if col.get('primary_key'):
+                col_str += " [PK]"
+            if col.get('foreign_key'):
+                col_str += " [FK]"
+            col_strs.append(col_str)
+        
+        return f"Table: {table_name}\nColumns: {', '.join(col_strs)}\nDescription: Database table containing {table_name} data"
+    
     def create_vector_store(
         self,
         connection_id: int,
@@ -87,27 +154,14 @@ class LocalRAGService:
         logger.info(f"Creating vector store for connection {connection_id}")
         
         # Convert schema and data to text documents
-        documents = []
+        documents = [self._format_table(table_name, columns) for table_name, columns in schema.items()]
         
-        # Add schema information with better formatting
-        for table_name, columns in schema.items():
-            col_strs = []
-            for col in columns:
-                col_str = f"{col['name']} ({col['type']})"
-                if col.get('primary_key'):
-                    col_str += " [PK]"
-                if col.get('foreign_key'):
-                    col_str += " [FK]"
-                col_strs.append(col_str)
-            
-            schema_text = f"Table: {table_name}\nColumns: {', '.join(col_strs)}\nDescription: Database table containing {table_name} data"
-            documents.append(schema_text)
-        
-        # Add sample data (limit to avoid overwhelming) with better formatting
-        for item in sample_data[:30]:  # Reduced sample size for performance
-            # Format data more clearly
-            formatted_item = json.dumps(item, indent=2, default=str)
-            documents.append(f"Sample data:\n{formatted_item}")
+        # Add sample data (limit to avoid overwhelming); compact JSON keeps
+        # whitespace out of the chunks and the embedded tokens
+        documents.extend(
+            f"Sample data:\n{orjson.dumps(item, default=str, option=orjson.OPT_NON_STR_KEYS).decode()}"
+            for item in sample_data[:30]  # Reduced sample size for performance
+        )
         
         logger.info(f"Processing {len(documents)} documents")
         
@@ -115,79 +169,101 @@ class LocalRAGService:
         texts = self.text_splitter.create_documents(documents)
         logger.info(f"Split into {len(texts)} chunks")
         
+        # Embed all chunks through the batched embedding path up front
+        contents = [doc.page_content for doc in texts]
+        vectors = self.embeddings.embed_documents(contents)
+        
         # Create vector store with pgvector
         collection_name = f"connection_{connection_id}"
-        vector_store = PGVector.from_documents(
-            documents=texts,
+        vector_store = IndexedPGVector.from_embeddings(
+            text_embeddings=list(zip(contents, vectors)),
             embedding=self.embeddings,
+            metadatas=[doc.metadata for doc in texts],
             collection_name=collection_name,
             connection_string=settings.DATABASE_URL
         )
         
+        if vectors:
+            ensure_hnsw_index(collection_name, len(vectors[0]))
+        self._retrieval_cache.invalidate(connection_id)
+        
         logger.info(f"✓ Vector store created: {collection_name}")
         return vector_store
     
+    def _load_vector_store(self, connection_id: int) -> IndexedPGVector:
+        """Get the shared vector store handle for a connection"""
+        return get_vector_store(f"connection_{connection_id}", self.embeddings)
+    
+    def _retrieve(self, user_query: str, connection_id: int, k: int = 2) -> List[Document]:
+        """Fetch the k most relevant chunks for a query, reusing recent results"""
+        cache_key = self._retrieval_cache.key(connection_id, k, user_query)
+        docs = self._retrieval_cache.get(cache_key)
+        if docs is None:
+            docs = self._load_vector_store(connection_id).similarity_search(user_query, k=k)
+            self._retrieval_cache.set(cache_key, docs)
+        return docs
+    
+    @staticmethod
+    def _build_rag_prompt(user_query: str, docs: List[Document]) -> str:
+        """Stuff the retrieved chunks into the answer prompt"""
+        return RAG_PROMPT_TEMPLATE.format(
+            context="\n\n".join(doc.page_content for doc in docs),
+            question=user_query
+        )
+    
     def query_with_rag(self, user_query: str, connection_id: int) -> str:
         """Query using RAG - retrieve relevant context and generate answer with performance optimization"""
         start_time = time.time()
         logger.info(f"Processing query for connection {connection_id}")
         
-        # Load existing vector store
-        collection_name = f"connection_{connection_id}"
-        vector_store = PGVector(
-            collection_name=collection_name,
-            connection_string=settings.DATABASE_URL,
-            embedding_function=self.embeddings
-        )
+        # Retrieve -> format -> generate, without a per-query chain
+        docs = self._retrieve(user_query, connection_id)
+        answer = self.llm.invoke(self._build_rag_prompt(user_query, docs))
         
-        # Create optimized prompt for faster processing
-        prompt_template = """You are a database assistant. Answer concisely using the context below.
-
-Context: {context}
-
-Question: {question}
-
-Instructions:
-- Be direct and concise
-- For SQL queries, use proper PostgreSQL syntax
-- If suggesting a query, format it clearly
-- Limit response to essential information
-
-Answer:"""
+        execution_time = time.time() - start_time
+        logger.info(f"✓ Query processed in {execution_time:.2f}s")
         
-        PROMPT = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
+        return answer
+    
+    async def _agenerate(self, prompt: str) -> str:
+        """Generate a completion without blocking the event loop"""
+        response = await self.aclient.generate(
+            model=self.ollama_model,
+            prompt=prompt,
+            options=self.llm_options
         )
+        return response["response"]
+    
+    async def aquery_with_rag(self, user_query: str, connection_id: int) -> str:
+        """Async variant of query_with_rag that awaits retrieval and generation"""
+        start_time = time.time()
+        logger.info(f"Processing query for connection {connection_id}")
         
-        # Create QA chain with optimized retrieval
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=vector_store.as_retriever(
-                search_kwargs={"k": 2}  # Reduced from 3 to 2 for speed
-            ),
-            chain_type_kwargs={"prompt": PROMPT},
-            return_source_documents=False
+        # Loading the store and searching both hit Postgres; keep them off the event loop
+        docs = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._retrieve, user_query, connection_id
         )
         
-        # Get answer
-        result = qa_chain.invoke({"query": user_query})
+        answer = await self._agenerate(self._build_rag_prompt(user_query, docs))
         
         execution_time = time.time() - start_time
         logger.info(f"✓ Query processed in {execution_time:.2f}s")
         
-        return result["result"]
+        return answer
     
-    def generate_query(
-        self,
-        user_intent: str,
-        schema: Dict[str, Any],
-        db_type: str
-    ) -> str:
-        """Generate database query from user intent with optimized prompts"""
-        logger.info(f"Generating {db_type} query")
+    async def aquery_batch(self, queries: List[str], connection_id: int) -> List[str]:
+        """
+        Answer several queries concurrently
         
+        Total latency approaches the slowest query rather than the sum,
+        provided Ollama runs with OLLAMA_NUM_PARALLEL > 1.
+        """
+        return await asyncio.gather(
+            *[self.aquery_with_rag(query, connection_id) for query in queries]
+        )
+    
+    def _build_query_prompt(self, user_intent: str, schema: Dict[str, Any], db_type: str) -> str:
+        """Build the query generation prompt with a concise schema summary"""
         # Create concise schema representation
         schema_summary = []
         for table_name, columns in schema.items():
@@ -197,7 +273,7 @@ Answer:"""
         schema_str = "; ".join(schema_summary)
         
         if db_type == "postgresql":
-            prompt = f"""Schema: {schema_str}
+            return f"""Schema: {schema_str}
 
 Generate PostgreSQL query for: {user_intent}
 
@@ -208,19 +284,18 @@ Rules:
 - Return only the SQL query
 
 Query:"""
-        else:  # mongodb
-            prompt = f"""Schema: {schema_str}
+        # mongodb
+        return f"""Schema: {schema_str}
 
 Generate MongoDB query for: {user_intent}
 
 Return only the query object as JSON.
 
 Query:"""
-        
-        response = self.llm.invoke(prompt)
-        logger.info("✓ Query generated")
-        
-        # Clean up response
+    
+    @staticmethod
+    def _clean_generated_query(response: str) -> str:
+        """Strip whitespace and code block markers from an LLM response"""
         query = response.strip()
         if query.startswith("```"):
             # Remove code block markers
@@ -228,3 +303,64 @@ Query:"""
             query = '\n'.join(lines[1:-1]) if len(lines) > 2 else query
         
         return query.strip()
+    
+    def generate_query(
+        self,
+        user_intent: str,
+        schema: Dict[str, Any],
+        db_type: str
+    ) -> str:
+        """Generate database query from user intent with optimized prompts"""
+        logger.info(f"Generating {db_type} query")
+        
+        prompt = self._build_query_prompt(user_intent, schema, db_type)
+        response = self.llm.invoke(prompt)
+        logger.info("✓ Query generated")
+        
+        return self._clean_generated_query(response)
+    
+    async def agenerate_query(
+        self,
+        user_intent: str,
+        schema: Dict[str, Any],
+        db_type: str
+    ) -> str:
+        """Async variant of generate_query"""
+        logger.info(f"Generating {db_type} query")
+        
+        prompt = self._build_query_prompt(user_intent, schema, db_type)
+        response = await self._agenerate(prompt)
+        logger.info("✓ Query generated")
+        
+        return self._clean_generated_query(response)
+    
+    async def agenerate_queries(
+        self,
+        user_intents: List[str],
+        schema: Dict[str, Any],
+        db_type: str
+    ) -> List[str]:
+        """Generate queries for several intents concurrently"""
+        return await asyncio.gather(
+            *[self.agenerate_query(intent, schema, db_type) for intent in user_intents]
+        )
+
+_local_rag_service_lock = threading.Lock()
+
+@lru_cache(maxsize=4)
+def _get_cached_local_rag_service(embedding_service_url: str, ollama_base_url: str,
+                                  ollama_model: str) -> LocalRAGService:
+    return LocalRAGService(
+        embedding_service_url=embedding_service_url,
+        ollama_base_url=ollama_base_url,
+        ollama_model=ollama_model
+    )
+
+def get_local_rag_service() -> LocalRAGService:
+    """Get the configured local RAG service, probing its backends only on first use"""
+    with _local_rag_service_lock:
+        return _get_cached_local_rag_service(
+            settings.EMBEDDING_SERVICE_URL,
+            settings.OLLAMA_BASE_URL,
+            settings.OLLAMA_MODEL
+        )
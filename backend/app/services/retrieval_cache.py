@@ -0,0 +1,57 @@
+"""
+Retrieval Cache
+Short-lived cache of similarity-search results for repeated questions
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+import hashlib
+import threading
+import time
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivially different phrasings share a key"""
+    return " ".join(query.lower().split())
+
+class RetrievalCache:
+    """
+    Bounded LRU of search results that expire after a TTL
+
+    Keys are (namespace, k, blake2b(normalized query)); a namespace is
+    typically a connection id or collection and can be invalidated as a
+    whole when that collection is re-indexed.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(namespace: Hashable, k: int, query: str) -> Tuple:
+        digest = hashlib.blake2b(normalize_query(query).encode(), digest_size=16).digest()
+        return (namespace, k, digest)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Tuple, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, namespace: Hashable):
+        """Drop every cached result for a namespace"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == namespace]:
+                del self._entries[key]
@@ -3,12 +3,17 @@ Vectorized Schema Store
 Intelligent schema pruning using embeddings for large databases (50+ tables)
 """
 
-from typing import Dict, List, Any, Optional
-from langchain_community.vectorstores import PGVector
-from langchain_openai import OpenAIEmbeddings
+from typing import Dict, Iterable, List, Any, Optional
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from app.core.config import settings
-import json
+from app.services.embedding_cache import CachedEmbeddings
+from app.services.local_embeddings import LocalEmbeddings
+from app.services.vector_index import (
+    IndexedPGVector, ensure_hnsw_index, drop_hnsw_index, get_vector_store, evict_vector_store,
+    collection_dimensions, collection_metadata
+)
+from app.services.retrieval_cache import RetrievalCache
+import orjson
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,19 +36,27 @@ class SchemaStore:
             chunk_size=500,
             chunk_overlap=50
         )
+        # Recent search results per (connection, k, normalized query)
+        self._retrieval_cache = RetrievalCache()
         
-        # Initialize embeddings
+        # Schema dimension actually produced by the embedding model, once known
+        self._dimensions: Optional[int] = None
+        # Connections whose stored collection has been checked against it
+        self._checked_dimensions: set = set()
+        
+        # Initialize embeddings: the same 384-dim local model the rest of the system uses
         try:
-            # Use OpenAI embeddings for schema (fast and accurate)
-            api_key = settings.OPENAI_API_KEY
-            if api_key:
-                self.embeddings = OpenAIEmbeddings(
-                    openai_api_key=api_key,
-                    model="text-embedding-ada-002"
-                )
-                logger.info("SchemaStore initialized with OpenAI embeddings")
-            else:
-                logger.warning("No OpenAI API key available for SchemaStore")
+            local_embeddings = LocalEmbeddings(
+                service_url=settings.EMBEDDING_SERVICE_URL,
+                batch_size=settings.EMBEDDING_BATCH_SIZE
+            )
+            self.embeddings = CachedEmbeddings(
+                local_embeddings,
+                provider="local",
+                model=local_embeddings.model,
+                connection_string=self.connection_string
+            )
+            logger.info("SchemaStore initialized with local embeddings")
         except Exception as e:
             logger.error(f"Failed to initialize embeddings: {e}")
     
@@ -81,20 +94,39 @@ class SchemaStore:
                     "connection_id": connection_id,
                     "db_type": db_type,
                     "column_count": len(columns),
-                    "columns": json.dumps(columns)
+                    "columns": columns  # stored as structured JSON, no string round-trip
                 }
                 metadatas.append(metadata)
             
             # Create or update vector store
             if documents:
-                vector_store = PGVector.from_texts(
-                    texts=documents,
+                # One batched embedding call for every table description
+                vectors = self.embeddings.embed_documents(documents)
+                self._dimensions = len(vectors[0])
+                
+                # Vectors of another size (e.g. 1536-dim ada-002) can't share the collection
+                stored = collection_dimensions(collection_name, self.connection_string)
+                recreate = stored is not None and stored != self._dimensions
+                if recreate:
+                    logger.warning(
+                        f"Schema collection {collection_name} holds {stored}-dim vectors, "
+                        f"model produces {self._dimensions}; recreating it"
+                    )
+                    drop_hnsw_index(collection_name, self.connection_string)
+                
+                vector_store = IndexedPGVector.from_embeddings(
+                    text_embeddings=list(zip(documents, vectors)),
                     embedding=self.embeddings,
                     metadatas=metadatas,
                     collection_name=collection_name,
-                    connection_string=self.connection_string
+                    connection_string=self.connection_string,
+                    pre_delete_collection=recreate
                 )
                 
+                ensure_hnsw_index(collection_name, self._dimensions, self.connection_string)
+                self._retrieval_cache.invalidate(connection_id)
+                self._checked_dimensions.add(connection_id)
+                
                 logger.info(f"Indexed {len(documents)} tables for connection {connection_id}")
                 return True
             
@@ -124,28 +156,21 @@ class SchemaStore:
         try:
             collection_name = f"schema_{connection_id}"
             
-            # Load vector store
-            vector_store = PGVector(
-                collection_name=collection_name,
-                connection_string=self.connection_string,
-                embedding_function=self.embeddings
-            )
-            
-            # Search for relevant tables
-            results = vector_store.similarity_search(query, k=k)
+            # Repeated questions skip the query embedding and the vector search
+            cache_key = self._retrieval_cache.key(connection_id, k, query)
+            results = self._retrieval_cache.get(cache_key)
+            if results is None:
+                self._ensure_dimensions(connection_id)
+                
+                # Reuse the cached handle for this collection
+                vector_store = get_vector_store(collection_name, self.embeddings, self.connection_string)
+                
+                # Search for relevant tables
+                results = vector_store.similarity_search(query, k=k)
+                self._retrieval_cache.set(cache_key, results)
             
             # Reconstruct schema from results
-            relevant_schema = {}
-            for doc in results:
-                metadata = doc.metadata
-                table_name = metadata.get("table_name")
-                columns_json = metadata.get("columns", "[]")
-                
-                try:
-                    columns = json.loads(columns_json)
-                    relevant_schema[table_name] = columns
-                except json.JSONDecodeError:
-                    logger.warning(f"Failed to parse columns for {table_name}")
+            relevant_schema = self._schema_from_results(results)
             
             logger.info(f"Retrieved {len(relevant_schema)} relevant tables for query")
             return relevant_schema
@@ -154,39 +179,74 @@ class SchemaStore:
             logger.error(f"Failed to retrieve relevant schema: {e}")
             return {}
     
+    def _ensure_dimensions(self, connection_id: int):
+        """
+        Re-index a collection embedded with a different model, once per process
+        
+        Collections built with 1536-dim OpenAI embeddings can't be searched
+        with 384-dim local query vectors. The stored metadata still holds
+        each table's columns, so the collection is rebuilt from it.
+        """
+        if connection_id in self._checked_dimensions:
+            return
+        collection_name = f"schema_{connection_id}"
+        
+        if self._dimensions is None:
+            self._dimensions = len(self.embeddings.embed_query(collection_name))
+        stored = collection_dimensions(collection_name, self.connection_string)
+        
+        if stored is not None and stored != self._dimensions:
+            logger.warning(
+                f"Schema collection {collection_name} holds {stored}-dim vectors, "
+                f"model produces {self._dimensions}; re-indexing"
+            )
+            metadatas = collection_metadata(collection_name, self.connection_string)
+            schema = self._schema_from_metadata(metadatas)
+            db_type = next((m.get("db_type") for m in metadatas if m.get("db_type")), "postgresql")
+            self.index_schema(connection_id, schema, db_type)
+        
+        self._checked_dimensions.add(connection_id)
+    
     def get_full_schema(self, connection_id: int) -> Dict[str, Any]:
         """
         Retrieve full schema (fallback when vector search fails)
         """
         try:
             collection_name = f"schema_{connection_id}"
-            vector_store = PGVector(
-                collection_name=collection_name,
-                connection_string=self.connection_string,
-                embedding_function=self.embeddings
-            )
-            
-            # Get all documents (high k value)
-            results = vector_store.similarity_search("all tables", k=1000)
-            
-            full_schema = {}
-            for doc in results:
-                metadata = doc.metadata
-                table_name = metadata.get("table_name")
-                columns_json = metadata.get("columns", "[]")
-                
-                try:
-                    columns = json.loads(columns_json)
-                    full_schema[table_name] = columns
-                except json.JSONDecodeError:
-                    pass
             
-            return full_schema
+            # Read every row's metadata directly; no query embedding or distance ranking
+            return self._schema_from_metadata(
+                collection_metadata(collection_name, self.connection_string)
+            )
             
         except Exception as e:
             logger.error(f"Failed to retrieve full schema: {e}")
             return {}
     
+    @classmethod
+    def _schema_from_results(cls, results: List[Any]) -> Dict[str, Any]:
+        """Rebuild {table_name: columns} from search results"""
+        return cls._schema_from_metadata(doc.metadata for doc in results)
+    
+    @staticmethod
+    def _schema_from_metadata(metadatas: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Rebuild {table_name: columns} from stored row metadata"""
+        schema = {}
+        for metadata in metadatas:
+            table_name = metadata.get("table_name")
+            columns = metadata.get("columns", [])
+            
+            # Collections indexed before columns were stored structured hold a JSON string
+            if isinstance(columns, str):
+                try:
+                    columns = orjson.loads(columns)
+                except orjson.JSONDecodeError:
+                    logger.warning(f"Failed to parse columns for {table_name}")
+                    continue
+            
+            schema[table_name] = columns
+        return schema
+    
     def _create_table_description(self, table_name: str, columns: List[Dict], 
                                    db_type: str) -> str:
         """
@@ -228,14 +288,14 @@ class SchemaStore:
         """
         try:
             collection_name = f"schema_{connection_id}"
-            vector_store = PGVector(
-                collection_name=collection_name,
-                connection_string=self.connection_string,
-                embedding_function=self.embeddings
-            )
+            vector_store = get_vector_store(collection_name, self.embeddings, self.connection_string)
             
             # Delete collection
+            drop_hnsw_index(collection_name, self.connection_string)
             vector_store.delete_collection()
+            evict_vector_store(collection_name, self.connection_string)
+            self._retrieval_cache.invalidate(connection_id)
+            self._checked_dimensions.discard(connection_id)
             logger.info(f"Deleted schema for connection {connection_id}")
             return True
             
@@ -0,0 +1,237 @@
+"""
+pgvector ANN Indexing
+Per-collection HNSW indexes on LangChain's shared embedding table
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_community.vectorstores import PGVector
+from langchain_community.vectorstores.pgvector import DistanceStrategy
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Float, cast, create_engine, literal, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.types import UserDefinedType
+from app.core.config import settings
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# HNSW build parameters (pgvector defaults)
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+
+# Connections shared by every vector store handle on the same database
+POOL_SIZE = 20
+MAX_OVERFLOW = 10
+
+# Collection handles kept warm across queries
+MAX_CACHED_STORES = 128
+
+# One engine per database URL, created on first use
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+# Whether each database's pgvector has halfvec (0.7+), once known
+_halfvec_support: Dict[str, bool] = {}
+
+# LRU of vector store handles by (database URL, collection, embeddings)
+_stores: "OrderedDict[Tuple[str, str, int], IndexedPGVector]" = OrderedDict()
+_stores_lock = threading.Lock()
+
+def get_engine(connection_string: str) -> Engine:
+    """Get or create a pooled engine for a vector database URL"""
+    engine = _engines.get(connection_string)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(connection_string)
+            if engine is None:
+                engine = create_engine(
+                    connection_string,
+                    pool_size=POOL_SIZE,
+                    max_overflow=MAX_OVERFLOW,
+                    pool_pre_ping=True,
+                    # Candidate list size for HNSW scans (recall vs speed)
+                    connect_args={"options": f"-c hnsw.ef_search={settings.HNSW_EF_SEARCH}"}
+                )
+                _engines[connection_string] = engine
+    return engine
+
+class HalfVector(UserDefinedType):
+    """pgvector halfvec(n): 16-bit floats, half the bytes of vector(n)"""
+    cache_ok = True
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def get_col_spec(self, **kw) -> str:
+        return f"HALFVEC({self.dim})"
+
+def supports_halfvec(connection_string: str) -> bool:
+    """Check (once per database) whether the vector extension is 0.7 or newer"""
+    supported = _halfvec_support.get(connection_string)
+    if supported is not None:
+        return supported
+    try:
+        with get_engine(connection_string).connect() as conn:
+            version = conn.execute(
+                text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            ).scalar()
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not read pgvector version: {e}")
+        return False
+    if version is None:
+        # Extension not created yet; ask again later
+        return False
+    supported = tuple(int(part) for part in version.split(".")[:2]) >= (0, 7)
+    _halfvec_support[connection_string] = supported
+    return supported
+
+def _collection_uuid(conn, collection_name: str) -> Optional[str]:
+    return conn.execute(
+        text("SELECT uuid FROM langchain_pg_collection WHERE name = :name"),
+        {"name": collection_name}
+    ).scalar()
+
+def collection_dimensions(collection_name: str,
+                          connection_string: Optional[str] = None) -> Optional[int]:
+    """Dimension of the vectors already stored in a collection, or None if it is empty"""
+    try:
+        with get_engine(connection_string or settings.DATABASE_URL).connect() as conn:
+            return conn.execute(
+                text(
+                    "SELECT vector_dims(e.embedding) FROM langchain_pg_embedding e "
+                    "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+                    "WHERE c.name = :name LIMIT 1"
+                ),
+                {"name": collection_name}
+            ).scalar()
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not read vector dimensions for {collection_name}: {e}")
+        return None
+
+def collection_metadata(collection_name: str,
+                        connection_string: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Metadata of every row in a collection, without a vector search"""
+    with get_engine(connection_string or settings.DATABASE_URL).connect() as conn:
+        return [
+            row[0] or {} for row in conn.execute(
+                text(
+                    "SELECT e.cmetadata FROM langchain_pg_embedding e "
+                    "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+                    "WHERE c.name = :name"
+                ),
+                {"name": collection_name}
+            )
+        ]
+
+def _index_name(collection_uuid) -> str:
+    return f"ix_hnsw_{str(collection_uuid).replace('-', '')}"
+
+def ensure_hnsw_index(collection_name: str, dimensions: int,
+                      connection_string: Optional[str] = None) -> bool:
+    """
+    Create an HNSW cosine index covering one collection's rows
+
+    langchain_pg_embedding.embedding has no fixed dimension, which HNSW
+    requires, so the index is on an expression cast to a fixed-size type
+    and is partial on the collection. On pgvector 0.7+ that type is
+    halfvec, halving the bytes the graph stores and traverses; older
+    versions use vector. IndexedPGVector orders by the same expression so
+    the planner can use it. When pgvector is too old for HNSW this logs
+    and returns False; searches stay exact.
+    """
+    connection_string = connection_string or settings.DATABASE_URL
+    if supports_halfvec(connection_string):
+        expression = f"(embedding::halfvec({int(dimensions)})) halfvec_cosine_ops"
+    else:
+        expression = f"(embedding::vector({int(dimensions)})) vector_cosine_ops"
+    try:
+        with get_engine(connection_string).begin() as conn:
+            collection_uuid = _collection_uuid(conn, collection_name)
+            if collection_uuid is None:
+                return False
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {_index_name(collection_uuid)} "
+                f"ON langchain_pg_embedding USING hnsw ({expression}) "
+                f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}) "
+                f"WHERE collection_id = '{collection_uuid}'"
+            ))
+        return True
+    except SQLAlchemyError as e:
+        logger.warning(f"HNSW index unavailable for {collection_name}, using exact search: {e}")
+        return False
+
+def drop_hnsw_index(collection_name: str, connection_string: Optional[str] = None):
+    """Drop a collection's HNSW index before the collection is deleted"""
+    try:
+        with get_engine(connection_string or settings.DATABASE_URL).begin() as conn:
+            collection_uuid = _collection_uuid(conn, collection_name)
+            if collection_uuid is not None:
+                conn.execute(text(f"DROP INDEX IF EXISTS {_index_name(collection_uuid)}"))
+    except SQLAlchemyError as e:
+        logger.warning(f"Failed to drop HNSW index for {collection_name}: {e}")
+
+class IndexedPGVector(PGVector):
+    """
+    PGVector whose cosine distance matches the ensure_hnsw_index expression
+
+    Handles run on the shared pooled engine for their database instead of
+    each creating its own.
+    """
+
+    def __init__(self, connection_string: str, *args, connection: Any = None, **kwargs):
+        super().__init__(
+            connection_string, *args,
+            connection=connection or get_engine(connection_string),
+            **kwargs
+        )
+        self._use_halfvec = supports_halfvec(connection_string)
+
+    @property
+    def distance_strategy(self) -> Any:
+        if self._distance_strategy != DistanceStrategy.COSINE:
+            return super().distance_strategy
+        column = self.EmbeddingStore.embedding
+        if self._use_halfvec:
+            def halfvec_cosine_distance(embedding):
+                half = HalfVector(len(embedding))
+                query = cast(literal(embedding, Vector(len(embedding))), half)
+                return cast(column, half).op("<=>", return_type=Float)(query)
+            return halfvec_cosine_distance
+        return lambda embedding: cast(column, Vector(len(embedding))).cosine_distance(embedding)
+
+def get_vector_store(collection_name: str, embeddings: Any,
+                     connection_string: Optional[str] = None) -> IndexedPGVector:
+    """
+    Get a cached handle for an existing collection
+
+    The collection row is looked up by name on every search, so a handle
+    stays valid when its collection is re-indexed.
+    """
+    connection_string = connection_string or settings.DATABASE_URL
+    key = (connection_string, collection_name, id(embeddings))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is not None:
+            _stores.move_to_end(key)
+            return store
+
+    store = IndexedPGVector(
+        connection_string=connection_string,
+        collection_name=collection_name,
+        embedding_function=embeddings
+    )
+    with _stores_lock:
+        store = _stores.setdefault(key, store)
+        _stores.move_to_end(key)
+        while len(_stores) > MAX_CACHED_STORES:
+            _stores.popitem(last=False)
+    return store
+
+def evict_vector_store(collection_name: str, connection_string: Optional[str] = None):
+    """Forget cached handles for a collection, e.g. after deleting it"""
+    connection_string = connection_string or settings.DATABASE_URL
+    with _stores_lock:
+        for key in [key for key in _stores if key[:2] == (connection_string, collection_name)]:
+            del _stores[key]
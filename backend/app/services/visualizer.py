@@ -6,10 +6,26 @@ Generates chart recommendations based on query results
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 from enum import Enum
+from functools import lru_cache
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+from app.core.executor import executor
+import pandas as pd
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+# ISO (2024-01-31), US (01/31/2024) and EU (31-01-2024) date prefixes
+DATETIME_REGEX = re.compile(r'^(?:\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4}|\d{2}-\d{2}-\d{4})')
+
+# Leading non-null values inspected when typing object columns
+DATETIME_SAMPLE = 5
+NUMERIC_SAMPLE = 10
+CATEGORY_PROBE = 200
+
+# Most distinct values a column can have and still be categorical
+MAX_CATEGORIES = 20
+
 class ChartType(Enum):
     LINE = "line"
     BAR = "bar"
@@ -28,6 +44,29 @@ class ChartRecommendation:
     data_mapping: Dict[str, Any]
     confidence: float
 
+@lru_cache(maxsize=256)
+def _chart_type_for(date_count: int, numeric_count: int, categorical_count: int,
+                    fits_pie: bool) -> ChartType:
+    """Pick a chart from column-type counts; result shapes repeat across queries"""
+    # Line chart: Time series with numeric values
+    if date_count and numeric_count:
+        return ChartType.LINE
+    
+    # Pie chart: Single categorical with numeric (few categories)
+    if categorical_count == 1 and numeric_count == 1 and fits_pie:
+        return ChartType.PIE
+    
+    # Bar chart: Categorical comparison
+    if categorical_count and numeric_count:
+        return ChartType.BAR
+    
+    # Scatter: Two numeric columns
+    if numeric_count >= 2:
+        return ChartType.SCATTER
+    
+    # Default to table
+    return ChartType.TABLE
+
 class Visualizer:
     """
     Analyzes query results and recommends appropriate visualizations
@@ -43,6 +82,7 @@ class Visualizer:
     def __init__(self):
         self.min_rows_for_chart = 2
         self.max_rows_for_pie = 10
+        self.executor = executor
     
     def recommend_visualization(self, results: List[Dict], 
                                query: str = "") -> ChartRecommendation:
@@ -67,15 +107,16 @@ class Visualizer:
                 confidence=1.0
             )
         
-        # Analyze result structure
+        # Analyze result structure column-wise in one DataFrame
+        df = pd.DataFrame(results)
         columns = list(results[0].keys())
-        column_types = self._analyze_column_types(results, columns)
+        column_types = self._analyze_column_types(df, columns)
         
         # Determine chart type
-        chart_type = self._determine_chart_type(results, columns, column_types, query)
+        chart_type = self._determine_chart_type(df, columns, column_types, query)
         
         # Map data to chart
-        data_mapping = self._map_data_to_chart(results, columns, column_types, chart_type)
+        data_mapping = self._map_data_to_chart(df, columns, column_types, chart_type)
         
         return ChartRecommendation(
             chart_type=chart_type,
@@ -95,82 +136,98 @@ class Visualizer:
         Returns:
             Plotly figure configuration as dict
         """
-        chart_type = recommendation.chart_type
+        generators = {
+            ChartType.LINE: self._generate_line_chart,
+            ChartType.BAR: self._generate_bar_chart,
+            ChartType.PIE: self._generate_pie_chart,
+            ChartType.SCATTER: self._generate_scatter_chart,
+        }
+        generate = generators.get(recommendation.chart_type, self._generate_table)
+        # Object dtype keeps the original cell values: inferred dtypes would
+        # turn integer columns with NULLs into (rounded) floats
+        return generate(pd.DataFrame(results, dtype=object), recommendation)
+    
+    def recommend_many(self, result_sets: List[List[Dict]],
+                       queries: Optional[List[str]] = None) -> List[ChartRecommendation]:
+        """
+        Recommend charts for several result sets at once (e.g. dashboard widgets)
         
-        if chart_type == ChartType.LINE:
-            return self._generate_line_chart(results, recommendation)
-        elif chart_type == ChartType.BAR:
-            return self._generate_bar_chart(results, recommendation)
-        elif chart_type == ChartType.PIE:
-            return self._generate_pie_chart(results, recommendation)
-        elif chart_type == ChartType.SCATTER:
-            return self._generate_scatter_chart(results, recommendation)
-        else:
-            return self._generate_table(results, recommendation)
+        Each result set is analyzed independently on the shared thread pool;
+        recommendations come back in input order.
+        """
+        queries = queries or [""] * len(result_sets)
+        return list(self.executor.map(self.recommend_visualization, result_sets, queries))
     
-    def _analyze_column_types(self, results: List[Dict], 
+    def generate_many(self, recommendations: List[ChartRecommendation],
+                      result_sets: List[List[Dict]]) -> List[Dict[str, Any]]:
+        """Build Plotly configs for paired recommendations and result sets in parallel"""
+        return list(self.executor.map(self.generate_plotly_config, recommendations, result_sets))
+    
+    def _analyze_column_types(self, df: pd.DataFrame, 
                              columns: List[str]) -> Dict[str, str]:
         """Analyze data types of columns"""
         types = {}
         
         for col in columns:
-            values = [row.get(col) for row in results if row.get(col) is not None]
+            series = df[col]
             
-            if not values:
+            if series.first_valid_index() is None:
                 types[col] = "unknown"
                 continue
+            # Typed columns are decided by dtype alone, without copying them
+            if is_datetime64_any_dtype(series):
+                types[col] = "datetime"
+                continue
+            if is_numeric_dtype(series):
+                types[col] = "numeric"
+                continue
             
-            # Check if date/time
-            if any(self._is_datetime(str(v)) for v in values[:5]):
+            values = series.dropna()
+            # Object columns: date-like strings, then numeric-like values (e.g. Decimal)
+            if values.head(DATETIME_SAMPLE).astype(str).str.match(DATETIME_REGEX).any():
                 types[col] = "datetime"
-            # Check if numeric
-            elif all(self._is_numeric(v) for v in values[:10]):
+            elif pd.to_numeric(values.head(NUMERIC_SAMPLE), errors="coerce").notna().all():
                 types[col] = "numeric"
+            # Too many distinct values in a prefix already rules out categorical
+            elif values.head(CATEGORY_PROBE).astype(str).nunique() > MAX_CATEGORIES:
+                types[col] = "text"
             # Check if categorical (few unique values)
-            elif len(set(str(v) for v in values)) <= min(len(values) * 0.5, 20):
+            elif values.astype(str).nunique() <= min(len(values) * 0.5, MAX_CATEGORIES):
                 types[col] = "categorical"
             else:
                 types[col] = "text"
         
         return types
     
-    def _determine_chart_type(self, results: List[Dict], columns: List[str],
+    @staticmethod
+    def _group_columns(column_types: Dict[str, str]) -> Dict[str, List[str]]:
+        """Split columns by type in one pass, keeping result order"""
+        groups = {"datetime": [], "numeric": [], "categorical": []}
+        for col, col_type in column_types.items():
+            group = groups.get(col_type)
+            if group is not None:
+                group.append(col)
+        return groups
+    
+    def _determine_chart_type(self, df: pd.DataFrame, columns: List[str],
                              column_types: Dict[str, str], query: str) -> ChartType:
         """Determine best chart type based on data"""
-        
-        # Time series detection
-        date_cols = [c for c, t in column_types.items() if t == "datetime"]
-        numeric_cols = [c for c, t in column_types.items() if t == "numeric"]
-        categorical_cols = [c for c, t in column_types.items() if t == "categorical"]
-        
-        # Line chart: Time series with numeric values
-        if date_cols and numeric_cols:
-            return ChartType.LINE
-        
-        # Pie chart: Single categorical with numeric (few categories)
-        if (len(categorical_cols) == 1 and len(numeric_cols) == 1 and 
-            len(results) <= self.max_rows_for_pie):
-            return ChartType.PIE
-        
-        # Bar chart: Categorical comparison
-        if categorical_cols and numeric_cols:
-            return ChartType.BAR
-        
-        # Scatter: Two numeric columns
-        if len(numeric_cols) >= 2:
-            return ChartType.SCATTER
-        
-        # Default to table
-        return ChartType.TABLE
+        groups = self._group_columns(column_types)
+        return _chart_type_for(
+            len(groups["datetime"]),
+            len(groups["numeric"]),
+            len(groups["categorical"]),
+            len(df) <= self.max_rows_for_pie
+        )
     
-    def _map_data_to_chart(self, results: List[Dict], columns: List[str],
+    def _map_data_to_chart(self, df: pd.DataFrame, columns: List[str],
                           column_types: Dict[str, str], 
                           chart_type: ChartType) -> Dict[str, Any]:
         """Map data columns to chart axes"""
-        
-        date_cols = [c for c, t in column_types.items() if t == "datetime"]
-        numeric_cols = [c for c, t in column_types.items() if t == "numeric"]
-        categorical_cols = [c for c, t in column_types.items() if t == "categorical"]
+        groups = self._group_columns(column_types)
+        date_cols = groups["datetime"]
+        numeric_cols = groups["numeric"]
+        categorical_cols = groups["categorical"]
         
         mapping = {}
         
@@ -192,16 +249,16 @@ class Visualizer:
         
         return mapping
     
-    def _generate_line_chart(self, results: List[Dict], 
+    def _generate_line_chart(self, df: pd.DataFrame, 
                             rec: ChartRecommendation) -> Dict[str, Any]:
         """Generate Plotly line chart config"""
-        x_col = rec.x_column or list(results[0].keys())[0]
-        y_col = rec.y_column or list(results[0].keys())[1]
+        x_col = rec.x_column or df.columns[0]
+        y_col = rec.y_column or df.columns[1]
         
         return {
             "data": [{
-                "x": [row.get(x_col) for row in results],
-                "y": [row.get(y_col) for row in results],
+                "x": self._column_values(df, x_col),
+                "y": self._column_values(df, y_col),
                 "type": "scatter",
                 "mode": "lines+markers",
                 "name": y_col
@@ -213,16 +270,16 @@ class Visualizer:
             }
         }
     
-    def _generate_bar_chart(self, results: List[Dict], 
+    def _generate_bar_chart(self, df: pd.DataFrame, 
                            rec: ChartRecommendation) -> Dict[str, Any]:
         """Generate Plotly bar chart config"""
-        x_col = rec.x_column or list(results[0].keys())[0]
-        y_col = rec.y_column or list(results[0].keys())[1]
+        x_col = rec.x_column or df.columns[0]
+        y_col = rec.y_column or df.columns[1]
         
         return {
             "data": [{
-                "x": [row.get(x_col) for row in results],
-                "y": [row.get(y_col) for row in results],
+                "x": self._column_values(df, x_col),
+                "y": self._column_values(df, y_col),
                 "type": "bar",
                 "name": y_col
             }],
@@ -233,17 +290,17 @@ class Visualizer:
             }
         }
     
-    def _generate_pie_chart(self, results: List[Dict], 
+    def _generate_pie_chart(self, df: pd.DataFrame, 
                            rec: ChartRecommendation) -> Dict[str, Any]:
         """Generate Plotly pie chart config"""
         mapping = rec.data_mapping
-        label_col = mapping.get("label_column", list(results[0].keys())[0])
-        value_col = mapping.get("value_column", list(results[0].keys())[1])
+        label_col = mapping.get("label_column", df.columns[0])
+        value_col = mapping.get("value_column", df.columns[1])
         
         return {
             "data": [{
-                "labels": [row.get(label_col) for row in results],
-                "values": [row.get(value_col) for row in results],
+                "labels": self._column_values(df, label_col),
+                "values": self._column_values(df, value_col),
                 "type": "pie",
                 "hole": 0.3
             }],
@@ -252,16 +309,16 @@ class Visualizer:
             }
         }
     
-    def _generate_scatter_chart(self, results: List[Dict], 
+    def _generate_scatter_chart(self, df: pd.DataFrame, 
                                rec: ChartRecommendation) -> Dict[str, Any]:
         """Generate Plotly scatter chart config"""
-        x_col = rec.x_column or list(results[0].keys())[0]
-        y_col = rec.y_column or list(results[0].keys())[1]
+        x_col = rec.x_column or df.columns[0]
+        y_col = rec.y_column or df.columns[1]
         
         return {
             "data": [{
-                "x": [row.get(x_col) for row in results],
-                "y": [row.get(y_col) for row in results],
+                "x": self._column_values(df, x_col),
+                "y": self._column_values(df, y_col),
                 "type": "scatter",
                 "mode": "markers",
                 "name": f"{y_col} vs {x_col}"
@@ -273,10 +330,10 @@ class Visualizer:
             }
         }
     
-    def _generate_table(self, results: List[Dict], 
+    def _generate_table(self, df: pd.DataFrame, 
                        rec: ChartRecommendation) -> Dict[str, Any]:
         """Generate data table config"""
-        columns = list(results[0].keys()) if results else []
+        columns = list(df.columns)
         
         return {
             "data": [{
@@ -287,7 +344,7 @@ class Visualizer:
                     "align": "left"
                 },
                 "cells": {
-                    "values": [[row.get(col) for row in results] for col in columns],
+                    "values": [self._column_values(df, col) for col in columns],
                     "align": "left"
                 }
             }],
@@ -296,15 +353,17 @@ class Visualizer:
             }
         }
     
+    @staticmethod
+    def _column_values(df: pd.DataFrame, col: str) -> List[Any]:
+        """Extract a column as a list, with missing values as None"""
+        series = df[col]
+        if series.hasnans:
+            series = series.astype(object).where(series.notna(), None)
+        return series.tolist()
+    
     def _is_datetime(self, value: str) -> bool:
         """Check if string looks like datetime"""
-        import re
-        patterns = [
-            r'^\d{4}-\d{2}-\d{2}',  # ISO date
-            r'^\d{2}/\d{2}/\d{4}',   # US date
-            r'^\d{2}-\d{2}-\d{4}',   # EU date
-        ]
-        return any(re.match(p, value) for p in patterns)
+        return DATETIME_REGEX.match(value) is not None
     
     def _is_numeric(self, value: Any) -> bool:
         """Check if value is numeric"""
@@ -4,8 +4,9 @@ Multi-stage cleaning pipeline for LLM-generated queries
 """
 
 import re
-import json
+import orjson
 import logging
+from functools import lru_cache
 from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
@@ -19,14 +20,73 @@ class QueryCleaner:
     4. Validate format
     """
     
+    # Compiled once at class load; tried in order: ```sql, ```json, bare ```, `inline`
+    MARKDOWN_REGEXES = [
+        re.compile(r'```sql\s*\n(.*?)\n```', re.DOTALL | re.IGNORECASE),
+        re.compile(r'```json\s*\n(.*?)\n```', re.DOTALL | re.IGNORECASE),
+        re.compile(r'```\s*\n(.*?)\n```', re.DOTALL | re.IGNORECASE),
+        re.compile(r'`(.*?)`', re.DOTALL | re.IGNORECASE),
+    ]
+    # Statement keywords a cleaned query may start with, after optional whitespace
+    SQL_START_REGEX = re.compile(r'\s*(?:SELECT|WITH|EXPLAIN|DESCRIBE|SHOW)\b', re.IGNORECASE)
+    # Same keywords at the start of any line (multiline, no newline in the indent)
+    SQL_START_LINE_REGEX = re.compile(
+        r'^[^\S\n]*(?:SELECT|WITH|EXPLAIN|DESCRIBE|SHOW)\b', re.IGNORECASE | re.MULTILINE
+    )
+    LINE_COMMENT_REGEX = re.compile(r'--.*$', re.MULTILINE)
+    BLOCK_COMMENT_REGEX = re.compile(r'/\*.*?\*/', re.DOTALL)
+    SELECT_START_REGEX = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+    # SELECT, FROM and the SELECT <number> exception found in the same single pass
+    STRUCTURE_SCAN_REGEX = re.compile(
+        r'(?P<constant>SELECT\s+\d)|\b(?P<from>FROM)\b|\b(?P<select>SELECT)\b',
+        re.IGNORECASE
+    )
+    LIMIT_REGEX = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+    WHITESPACE_REGEX = re.compile(r'\s+')
+    
+    # Keywords uppercased by normalize_query
+    NORMALIZE_KEYWORDS = ['SELECT', 'FROM', 'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 
+                          'OUTER', 'ON', 'GROUP', 'BY', 'ORDER', 'LIMIT', 'OFFSET',
+                          'AND', 'OR', 'NOT', 'NULL', 'AS', 'DISTINCT', 'UNION', 'ALL']
+    # All keywords in one alternation so the query is scanned once
+    KEYWORD_REGEX = re.compile(
+        r'\b(?:' + '|'.join(NORMALIZE_KEYWORDS) + r')\b',
+        re.IGNORECASE
+    )
+    
     @staticmethod
     def clean_sql_query(raw_query: str) -> Tuple[str, bool]:
         """
         Clean SQL query from LLM output
         
+        Results are cached per raw query, since LLM output often repeats.
+        
+        Returns:
+            Tuple of (cleaned_query, is_valid)
+        """
+        return _clean_sql_cached(raw_query)
+    
+    @staticmethod
+    def clean_mongodb_query(raw_query: str) -> Tuple[str, bool]:
+        """
+        Clean MongoDB query from LLM output
+        
+        Results are cached per raw query, since LLM output often repeats.
+        
         Returns:
             Tuple of (cleaned_query, is_valid)
         """
+        return _clean_mongodb_cached(raw_query)
+    
+    @staticmethod
+    def clear_cache():
+        """Drop all cached cleaning results"""
+        _clean_sql_cached.cache_clear()
+        _clean_mongodb_cached.cache_clear()
+    
+    @staticmethod
+    def _clean_sql_query(raw_query: str) -> Tuple[str, bool]:
+        """Uncached cleaning behind clean_sql_query()"""
         if not raw_query:
             return "", False
         
@@ -47,13 +107,8 @@ class QueryCleaner:
         return query.strip(), is_valid
     
     @staticmethod
-    def clean_mongodb_query(raw_query: str) -> Tuple[str, bool]:
-        """
-        Clean MongoDB query from LLM output
-        
-        Returns:
-            Tuple of (cleaned_query, is_valid)
-        """
+    def _clean_mongodb_query(raw_query: str) -> Tuple[str, bool]:
+        """Uncached cleaning behind clean_mongodb_query()"""
         if not raw_query:
             return "", False
         
@@ -62,28 +117,27 @@ class QueryCleaner:
         # Stage 1: Extract from markdown
         query = QueryCleaner._extract_from_markdown(query)
         
-        # Stage 2: Try to parse as JSON
+        # Stage 2: Validate as JSON
         try:
-            query_obj = json.loads(query)
-            # Re-serialize to ensure valid JSON
-            return json.dumps(query_obj), True
-        except json.JSONDecodeError:
+            query_obj = orjson.loads(query)
+            # A parsed object or array is already valid JSON text; only re-serialize other values
+            if query[:1] in ('{', '['):
+                return query, True
+            return orjson.dumps(query_obj).decode(), True
+        except orjson.JSONDecodeError:
             logger.warning(f"Invalid JSON in MongoDB query: {query[:100]}")
             return query, False
     
     @staticmethod
     def _extract_from_markdown(text: str) -> str:
         """Extract content from markdown code blocks"""
+        # Every pattern needs a backtick; most LLM output has none
+        if '`' not in text:
+            return text
+        
         # Handle ```sql ... ``` or ```json ... ```
-        patterns = [
-            r'```sql\s*\n(.*?)\n```',  # SQL code block
-            r'```json\s*\n(.*?)\n```',  # JSON code block
-            r'```\s*\n(.*?)\n```',  # Generic code block
-            r'`(.*?)`',  # Inline code
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
+        for pattern in QueryCleaner.MARKDOWN_REGEXES:
+            match = pattern.search(text)
             if match:
                 return match.group(1).strip()
         
@@ -93,34 +147,32 @@ class QueryCleaner:
     def _remove_sql_comments(query: str) -> str:
         """Remove SQL comments (-- and /* */)"""
         # Remove single-line comments
-        query = re.sub(r'--.*$', '', query, flags=re.MULTILINE)
+        query = QueryCleaner.LINE_COMMENT_REGEX.sub('', query)
         # Remove multi-line comments
-        query = re.sub(r'/\*.*?\*/', '', query, flags=re.DOTALL)
+        query = QueryCleaner.BLOCK_COMMENT_REGEX.sub('', query)
         return query
     
     @staticmethod
     def _strip_explanations(query: str) -> str:
         """Strip explanatory text before/after the query"""
-        lines = query.split('\n')
-        
-        # Find first line that looks like SQL
-        sql_keywords = ['SELECT', 'WITH', 'EXPLAIN', 'DESCRIBE', 'SHOW']
-        start_idx = 0
-        for i, line in enumerate(lines):
-            stripped = line.strip().upper()
-            if any(stripped.startswith(kw) for kw in sql_keywords):
-                start_idx = i
-                break
-        
-        # Find last line that ends SQL (ends with ; or is last statement)
-        end_idx = len(lines)
-        for i in range(len(lines) - 1, start_idx - 1, -1):
-            line = lines[i].strip()
+        # First line that looks like SQL
+        match = QueryCleaner.SQL_START_LINE_REGEX.search(query)
+        start = match.start() if match else 0
+        
+        # Walk back line by line to the last one with content that isn't a comment
+        end = len(query)
+        line_end = len(query)
+        while True:
+            line_start = query.rfind('\n', 0, line_end) + 1
+            line = query[line_start:line_end].strip()
             if line and not line.startswith('--'):
-                end_idx = i + 1
+                end = line_end
+                break
+            if line_start <= start:
                 break
+            line_end = line_start - 1
         
-        return '\n'.join(lines[start_idx:end_idx])
+        return query[start:end]
     
     @staticmethod
     def _validate_sql_format(query: str) -> bool:
@@ -128,32 +180,28 @@ class QueryCleaner:
         if not query:
             return False
         
-        query_upper = query.upper().strip()
-        
         # Must start with allowed keywords
-        allowed_starts = ['SELECT', 'WITH', 'EXPLAIN', 'DESCRIBE', 'SHOW']
-        if not any(query_upper.startswith(kw) for kw in allowed_starts):
+        if not QueryCleaner.SQL_START_REGEX.match(query):
             return False
         
-        # Should contain FROM or a valid structure
-        if 'SELECT' in query_upper and 'FROM' not in query_upper:
-            # Exception for SELECT without FROM (e.g., SELECT 1)
-            if not re.search(r'SELECT\s+\d+', query_upper):
-                return False
+        # A SELECT needs a FROM, except SELECT <number> (e.g., SELECT 1)
+        has_select = False
+        for match in QueryCleaner.STRUCTURE_SCAN_REGEX.finditer(query):
+            if match.lastgroup != "select":
+                return True
+            has_select = True
         
-        return True
+        return not has_select
     
     @staticmethod
     def add_limit_if_missing(query: str, default_limit: int = 100) -> str:
         """Add LIMIT clause if not present"""
-        query_upper = query.upper()
-        
         # Check if LIMIT already exists
-        if 'LIMIT' in query_upper:
+        if QueryCleaner.LIMIT_REGEX.search(query):
             return query
         
         # Check if it's a SELECT statement
-        if not query_upper.strip().startswith('SELECT'):
+        if not QueryCleaner.SELECT_START_REGEX.match(query):
             return query
         
         # Add LIMIT before any trailing semicolon
@@ -170,16 +218,20 @@ class QueryCleaner:
         """Normalize query formatting"""
         if db_type == "postgresql":
             # Ensure proper spacing
-            query = re.sub(r'\s+', ' ', query)
+            query = QueryCleaner.WHITESPACE_REGEX.sub(' ', query)
             # Uppercase keywords
-            keywords = ['SELECT', 'FROM', 'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 
-                       'OUTER', 'ON', 'GROUP', 'BY', 'ORDER', 'LIMIT', 'OFFSET',
-                       'AND', 'OR', 'NOT', 'NULL', 'AS', 'DISTINCT', 'UNION', 'ALL']
-            for kw in keywords:
-                query = re.sub(rf'\b{kw}\b', kw, query, flags=re.IGNORECASE)
+            query = QueryCleaner.KEYWORD_REGEX.sub(lambda m: m.group(0).upper(), query)
         
         return query.strip()
 
+@lru_cache(maxsize=2048)
+def _clean_sql_cached(raw_query: str) -> Tuple[str, bool]:
+    return QueryCleaner._clean_sql_query(raw_query)
+
+@lru_cache(maxsize=2048)
+def _clean_mongodb_cached(raw_query: str) -> Tuple[str, bool]:
+    return QueryCleaner._clean_mongodb_query(raw_query)
+
 # Convenience functions
 def clean_query(raw_query: str, db_type: str) -> Tuple[str, bool]:
     """Clean query based on database type"""
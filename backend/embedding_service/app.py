@@ -2,25 +2,289 @@
 Self-Hosted Embedding Service
 Uses sentence-transformers for free, local embeddings
 """
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field
 from sentence_transformers import SentenceTransformer
-from typing import List
+from sentence_transformers.quantization import quantize_embeddings
+from transformers import AutoTokenizer, PreTrainedTokenizerFast
+from contextlib import nullcontext
+from typing import Dict, List, Literal, Optional, Tuple
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+import asyncio
+import hashlib
 import logging
+import numpy as np
+import orjson
+import os
+import torch
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Local Embedding Service")
 
+# Embedding payloads are large float arrays; compress them when the client accepts it
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Worker processes serving the API; each loads its own copy of the model
+WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+
+# Intra-op (OpenMP/MKL) threads per worker: the cores split between
+# workers. Containers often report a default of 1, so set it explicitly.
+THREADS = int(os.getenv("EMBED_THREADS", max(1, (os.cpu_count() or 1) // WORKERS)))
+torch.set_num_threads(THREADS)
+# One encode runs at a time, so inter-op parallelism only adds contention
+torch.set_num_interop_threads(1)
+
+def _detect_device() -> str:
+    """Pick the fastest available torch device"""
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
 # Load model on startup (cached in memory)
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-logger.info(f"Loading embedding model: {MODEL_NAME}")
-model = SentenceTransformer(MODEL_NAME)
+DEVICE = os.getenv("EMBED_DEVICE") or _detect_device()
+
+# "torch", or "onnx" for ONNX Runtime; the model repo ships an int8
+# AVX512-VNNI export of MiniLM for CPU hosts
+BACKEND = os.getenv("EMBED_BACKEND", "torch")
+ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
+logger.info(f"Loading embedding model: {MODEL_NAME} on {DEVICE} ({BACKEND})")
+if BACKEND == "onnx":
+    model = SentenceTransformer(
+        MODEL_NAME,
+        device=DEVICE,
+        backend="onnx",
+        model_kwargs={"file_name": ONNX_FILE}
+    )
+else:
+    model = SentenceTransformer(MODEL_NAME, device=DEVICE)
+    if DEVICE == "cuda":
+        # FP16 weights: half the memory traffic, tensor-core matmuls
+        model.half()
+
+# Fuse the transformer forward into fewer kernels with torch.compile; opt-in
+# because compiling adds tens of seconds to startup
+COMPILE = BACKEND == "torch" and os.getenv("EMBED_COMPILE") == "1"
+if COMPILE:
+    model[0].auto_model = torch.compile(model[0].auto_model, mode="reduce-overhead", dynamic=True)
+
+# bfloat16 autocast for CPUs with native BF16 (AMX / AVX512-BF16); opt-in
+CPU_BF16 = BACKEND == "torch" and DEVICE == "cpu" and os.getenv("EMBED_CPU_BF16") == "1"
+
+# Tokenize with the Rust-backed fast tokenizer
+if not isinstance(model.tokenizer, PreTrainedTokenizerFast):
+    model.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True)
 logger.info("Model loaded successfully")
+DIMENSIONS = model.get_sentence_embedding_dimension()
+
+# Texts per forward pass: large batches keep a GPU busy, small ones waste
+# less padding on CPU
+DEFAULT_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 8 if DEVICE == "cpu" else 64))
+MAX_BATCH_SIZE = 256
+
+def _encode(texts: List[str], batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+    """
+    Encode texts in mini-batches of similar token length
+    
+    The whole request is tokenized in one fast-tokenizer call. Texts are
+    then ordered by token count so each forward pass pads to a length
+    close to its own texts instead of the longest in the request; each
+    mini-batch is padded from the existing token ids rather than
+    re-tokenized, and rows are written back in input order.
+    """
+    # Same preprocessing sentence-transformers applies before tokenizing
+    encoded = model.tokenizer(
+        [text.strip() for text in texts], truncation=True, max_length=model.max_seq_length
+    )
+    order = np.argsort([len(ids) for ids in encoded["input_ids"]], kind="stable")
+    
+    embeddings = np.empty(
+        (len(texts), DIMENSIONS), dtype=np.float32
+    )
+    autocast = torch.autocast("cpu", dtype=torch.bfloat16) if CPU_BF16 else nullcontext()
+    with torch.inference_mode(), autocast:
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            features = model.tokenizer.pad(
+                {key: [encoded[key][i] for i in batch] for key in encoded.keys()},
+                return_tensors="pt"
+            )
+            output = model({key: value.to(model.device) for key, value in features.items()})
+            # Reduced-precision outputs are widened to float32 before normalizing
+            vectors = torch.nn.functional.normalize(output["sentence_embedding"].float(), p=2, dim=1)
+            embeddings[batch] = vectors.cpu().numpy()
+    return embeddings
+
+def _warmup():
+    """Encode once up front so the first request doesn't pay for lazy initialization"""
+    _encode(["warmup"] * 8, 8)
+    if COMPILE:
+        # Trace short, medium and long inputs so real requests don't trigger recompiles
+        for words in (16, 64, 256):
+            _encode([" ".join(["warmup"] * words)] * 8, 8)
+    elif DEVICE != "cpu":
+        # Kernels are also selected per shape; cover a long sequence too
+        _encode([" ".join(["warmup"] * 256)] * 8, 8)
+    logger.info("Model warmed up")
+
+_warmup()
+
+# Requests arriving within this window share encode passes
+COALESCE_WINDOW = float(os.getenv("EMBED_COALESCE_MS", "5")) / 1000
+MAX_COALESCED_TEXTS = 512
+
+class _EncodeBatcher:
+    """
+    Merges concurrent /embeddings requests into shared encode passes
+    
+    Handlers enqueue their texts and await a future. A single background
+    task collects requests for up to COALESCE_WINDOW (or until
+    MAX_COALESCED_TEXTS texts), encodes each batch_size group in one
+    _encode call on a worker thread, and hands every request its rows.
+    Only one encode runs at a time, so the model is never shared between
+    threads.
+    """
+    
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+    
+    async def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, batch_size, future))
+        return await future
+    
+    async def _collect(self) -> List[Tuple[List[str], int, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        pending = [await self._queue.get()]
+        total = len(pending[0][0])
+        deadline = loop.time() + COALESCE_WINDOW
+        
+        while total < MAX_COALESCED_TEXTS:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            pending.append(item)
+            total += len(item[0])
+        return pending
+    
+    async def _run(self):
+        while True:
+            groups: Dict[int, list] = {}
+            for item in await self._collect():
+                groups.setdefault(item[1], []).append(item)
+            
+            for batch_size, items in groups.items():
+                texts = [text for item_texts, _, _ in items for text in item_texts]
+                try:
+                    embeddings = await asyncio.to_thread(_encode, texts, batch_size)
+                except Exception as e:
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                
+                offset = 0
+                for item_texts, _, future in items:
+                    # Skip callers that disconnected while waiting
+                    if not future.done():
+                        future.set_result(embeddings[offset:offset + len(item_texts)])
+                    offset += len(item_texts)
+
+batcher = _EncodeBatcher()
+
+# Optional Redis cache of float32 vectors for texts embedded before
+CACHE_URL = os.getenv("EMBED_CACHE_REDIS_URL")
+CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", 7 * 24 * 3600))
+# Vectors differ between models and backends, so both are part of the key
+CACHE_PREFIX = f"emb:{MODEL_NAME}:{BACKEND}:"
+cache = aioredis.from_url(CACHE_URL) if CACHE_URL else None
+
+def _cache_key(text: str) -> str:
+    return CACHE_PREFIX + hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+async def _embed(texts: List[str], batch_size: int) -> np.ndarray:
+    """Embed texts, encoding only those missing from the cache"""
+    if cache is None:
+        return await batcher.encode(texts, batch_size)
+    
+    keys = [_cache_key(text) for text in texts]
+    try:
+        cached = await cache.mget(keys)
+    except RedisError as e:
+        logger.warning(f"Embedding cache lookup failed: {e}")
+        return await batcher.encode(texts, batch_size)
+    
+    embeddings = np.empty((len(texts), DIMENSIONS), dtype=np.float32)
+    missing = []
+    for i, value in enumerate(cached):
+        if value is None:
+            missing.append(i)
+        else:
+            embeddings[i] = np.frombuffer(value, dtype="<f4")
+    
+    if missing:
+        new_embeddings = await batcher.encode([texts[i] for i in missing], batch_size)
+        embeddings[missing] = new_embeddings
+        try:
+            async with cache.pipeline(transaction=False) as pipe:
+                for i, embedding in zip(missing, new_embeddings):
+                    pipe.set(keys[i], embedding.astype("<f4", copy=False).tobytes(), ex=CACHE_TTL)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Failed to store embeddings in cache: {e}")
+    
+    return embeddings
+
+@app.on_event("startup")
+async def start_batcher():
+    batcher.start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
 
 class EmbeddingRequest(BaseModel):
     texts: List[str]
+    # Texts per forward pass; defaults to DEFAULT_BATCH_SIZE for this device
+    batch_size: Optional[int] = Field(default=None, ge=1, le=MAX_BATCH_SIZE)
+    # float16 halves and int8 quarters the response and storage size
+    precision: Literal["float32", "float16", "int8"] = "float32"
+
+# Accept type for responses as packed rows; shape in X-Embedding-Shape,
+# element type in X-Embedding-Dtype
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+# Little-endian wire types per requested precision
+PRECISION_DTYPES = {"float32": "<f4", "float16": "<f2", "int8": "i1"}
+
+# Outputs are L2-normalized, so every component lies in [-1, 1]; fixed
+# int8 ranges keep quantized vectors comparable across requests
+INT8_RANGES = np.array([[-1.0] * DIMENSIONS, [1.0] * DIMENSIONS])
+
+def _quantize(embeddings: np.ndarray, precision: str) -> np.ndarray:
+    """Convert float32 embeddings to the requested output precision"""
+    if precision == "int8":
+        return quantize_embeddings(embeddings, precision="int8", ranges=INT8_RANGES)
+    return embeddings.astype(PRECISION_DTYPES[precision], copy=False)
 
 class EmbeddingResponse(BaseModel):
     embeddings: List[List[float]]
@@ -29,25 +293,45 @@ class EmbeddingResponse(BaseModel):
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "model": MODEL_NAME}
+    return {
+        "status": "healthy",
+        "model": MODEL_NAME,
+        "device": DEVICE,
+        "backend": BACKEND,
+        "threads": THREADS
+    }
 
 @app.post("/embeddings", response_model=EmbeddingResponse)
-async def create_embeddings(request: EmbeddingRequest):
+async def create_embeddings(request: EmbeddingRequest, accept: Optional[str] = Header(default=None)):
     """Generate embeddings for input texts"""
     try:
         if not request.texts:
             raise HTTPException(status_code=400, detail="No texts provided")
         
         # Generate embeddings
-        embeddings = model.encode(request.texts, convert_to_numpy=True)
+        embeddings = await _embed(request.texts, request.batch_size or DEFAULT_BATCH_SIZE)
+        
+        embeddings = _quantize(embeddings, request.precision)
         
-        # Convert to list format
-        embeddings_list = embeddings.tolist()
+        # Raw little-endian rows for clients that ask for them
+        if accept and BINARY_MEDIA_TYPE in accept:
+            return Response(
+                content=embeddings.astype(PRECISION_DTYPES[request.precision], copy=False).tobytes(),
+                media_type=BINARY_MEDIA_TYPE,
+                headers={
+                    "X-Embedding-Shape": f"{embeddings.shape[0]},{embeddings.shape[1]}",
+                    "X-Embedding-Dtype": request.precision,
+                    "X-Embedding-Model": MODEL_NAME
+                }
+            )
         
-        return EmbeddingResponse(
-            embeddings=embeddings_list,
-            model=MODEL_NAME,
-            dimensions=len(embeddings_list[0])
+        # JSON straight from the array, without per-float Python objects or model validation
+        return Response(
+            content=orjson.dumps(
+                {"embeddings": embeddings, "model": MODEL_NAME, "dimensions": embeddings.shape[1]},
+                option=orjson.OPT_SERIALIZE_NUMPY
+            ),
+            media_type="application/json"
         )
     
     except Exception as e:
@@ -64,4 +348,5 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # Multiple workers need an import string; a single one reuses this module's model
+    uvicorn.run("app:app" if WORKERS > 1 else app, host="0.0.0.0", port=8001, workers=WORKERS)
@@ -0,0 +1,78 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16
+
+Tables may already exist on deployments that were bootstrapped with
+Base.metadata.create_all(), so each table is only created when missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def _has_table(name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(name)
+
+def upgrade():
+    if not _has_table("users"):
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("email", sa.String()),
+            sa.Column("hashed_password", sa.String()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if not _has_table("user_settings"):
+        op.create_table(
+            "user_settings",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer()),
+            sa.Column("llm_provider", sa.String()),
+            sa.Column("llm_api_key", sa.Text()),
+            sa.Column("llm_model", sa.String()),
+            sa.Column("created_at", sa.DateTime()),
+            sa.Column("updated_at", sa.DateTime()),
+        )
+        op.create_index("ix_user_settings_id", "user_settings", ["id"])
+        op.create_index("ix_user_settings_user_id", "user_settings", ["user_id"], unique=True)
+
+    if not _has_table("database_connections"):
+        op.create_table(
+            "database_connections",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer()),
+            sa.Column("name", sa.String()),
+            sa.Column("db_type", sa.String()),
+            sa.Column("connection_string", sa.Text()),
+            sa.Column("db_metadata", sa.JSON()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_database_connections_id", "database_connections", ["id"])
+        op.create_index("ix_database_connections_user_id", "database_connections", ["user_id"])
+
+    if not _has_table("query_history"):
+        op.create_table(
+            "query_history",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer()),
+            sa.Column("connection_id", sa.Integer()),
+            sa.Column("query", sa.Text()),
+            sa.Column("response", sa.Text()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_query_history_id", "query_history", ["id"])
+        op.create_index("ix_query_history_user_id", "query_history", ["user_id"])
+
+def downgrade():
+    op.drop_table("query_history")
+    op.drop_table("database_connections")
+    op.drop_table("user_settings")
+    op.drop_table("users")
@@ -0,0 +1,68 @@
+"""Server-side timestamps and composite indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16
+
+Existing timestamps were written with datetime.utcnow(), so naive values
+are interpreted as UTC when converting to timestamptz.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+TIMESTAMP_COLUMNS = [
+    ("users", "created_at"),
+    ("user_settings", "created_at"),
+    ("user_settings", "updated_at"),
+    ("database_connections", "created_at"),
+    ("query_history", "created_at"),
+]
+
+def _is_timezone_aware(table: str, column: str) -> bool:
+    columns = sa.inspect(op.get_bind()).get_columns(table)
+    col = next(c for c in columns if c["name"] == column)
+    return bool(getattr(col["type"], "timezone", False))
+
+def _has_index(table: str, name: str) -> bool:
+    indexes = sa.inspect(op.get_bind()).get_indexes(table)
+    return any(idx["name"] == name for idx in indexes)
+
+def upgrade():
+    for table, column in TIMESTAMP_COLUMNS:
+        if _is_timezone_aware(table, column):
+            continue
+        op.alter_column(
+            table, column,
+            type_=sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            postgresql_using=f"{column} AT TIME ZONE 'UTC'",
+        )
+
+    # create_all() fallback in init_db() may already have built these
+    if not _has_index("database_connections", "ix_database_connections_user_id_name"):
+        op.create_index(
+            "ix_database_connections_user_id_name",
+            "database_connections", ["user_id", "name"]
+        )
+    if not _has_index("query_history", "ix_query_history_user_id_created_at"):
+        op.create_index(
+            "ix_query_history_user_id_created_at",
+            "query_history", ["user_id", "created_at"]
+        )
+
+def downgrade():
+    op.drop_index("ix_query_history_user_id_created_at", table_name="query_history")
+    op.drop_index("ix_database_connections_user_id_name", table_name="database_connections")
+
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(
+            table, column,
+            type_=sa.DateTime(),
+            server_default=None,
+            postgresql_using=f"{column} AT TIME ZONE 'UTC'",
+        )
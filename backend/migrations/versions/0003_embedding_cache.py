@@ -0,0 +1,33 @@
+"""Embedding cache table
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16
+
+Stores embedding vectors keyed by the SHA-256 of the embedded text so
+re-indexing a connection only embeds chunks that changed.
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+
+    # create_all() fallback in init_db() may already have built it
+    if not sa.inspect(op.get_bind()).has_table("embedding_cache"):
+        op.create_table(
+            "embedding_cache",
+            sa.Column("hash", sa.LargeBinary(), primary_key=True),
+            sa.Column("provider", sa.String(), primary_key=True),
+            sa.Column("model", sa.String(), primary_key=True),
+            sa.Column("vec", Vector()),
+        )
+
+def downgrade():
+    op.drop_table("embedding_cache")
@@ -2,6 +2,7 @@
 Startup script for backend
 Ensures proper binding to all interfaces for AWS deployment
 """
+import subprocess
 import uvicorn
 import os
 
@@ -9,6 +10,17 @@ if __name__ == "__main__":
     # Get port from environment or default to 8000
     port = int(os.getenv("PORT", "8000"))
     
+    # Each worker loads its own copy of langchain/pandas/Presidio and keeps
+    # its own caches, so scale out explicitly with WEB_CONCURRENCY
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    
+    # Apply migrations once, before any worker starts and calls init_db()
+    subprocess.run(
+        ["alembic", "upgrade", "head"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True
+    )
+    
     # Bind to all interfaces (0.0.0.0) for AWS deployment
     # This allows external access to the backend
     uvicorn.run(
@@ -16,5 +28,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=port,
         reload=False,  # Disable reload in production
-        workers=1
+        loop="uvloop",  # C event loop and parser from uvicorn[standard]
+        http="httptools",
+        workers=workers
     )
@@ -5,10 +5,15 @@ Tests all new features and components
 
 import pytest
 import json
+import hashlib
 from unittest.mock import Mock, patch, MagicMock
 from app.utils.query_cleaner import QueryCleaner, clean_query
 from app.services.query_validator import QueryValidator, validate_query
 from app.services.schema_store import SchemaStore
+from app.services.local_embeddings import LocalEmbeddings
+from app.services.embedding_cache import CachedEmbeddings
+from app.services.rag_service_local import LocalRAGService
+from app.services.retrieval_cache import RetrievalCache
 from app.services.pii_redaction import PIIRedactor, SimplePIIRedactor
 from app.services.visualizer import Visualizer, ChartType
 from app.agents.sql_agent import SQLAgent
@@ -62,6 +67,21 @@ class TestQueryValidator:
         assert result.is_valid is False
         assert any("injection" in err.lower() for err in result.errors)
     
+    def test_validate_lowercase_injection(self):
+        validator = QueryValidator()
+        result = validator.validate("select name from users union select password from admins", "postgresql")
+        assert result.is_valid is False
+        assert any("UNION" in err for err in result.errors)
+    
+    def test_cheap_layers_skip_sqlparse(self):
+        QueryValidator.clear_cache()
+        validator = QueryValidator()
+        with patch("app.services.query_validator.sqlparse.parse") as mock_parse:
+            assert validator.validate("SELECT * FROM users WHERE 1=1").is_valid is False
+            assert validator.validate("DROP TABLE users").is_valid is False
+            assert validator.validate("SELECT id FROM users LIMIT 5").is_valid is True
+            mock_parse.assert_not_called()
+    
     def test_validate_table_whitelist(self):
         validator = QueryValidator(allowed_tables={"users", "orders"})
         result = validator.validate("SELECT * FROM products", "postgresql")
@@ -72,11 +92,17 @@ class TestQueryValidator:
         validator = QueryValidator()
         assert validator.is_read_only("SELECT * FROM users") is True
         assert validator.is_read_only("INSERT INTO users VALUES (1)") is False
+    
+    def test_forbidden_keywords_match_whole_words(self):
+        validator = QueryValidator()
+        result = validator.validate("SELECT created_at, updated_at FROM users LIMIT 10", "postgresql")
+        assert result.is_valid is True
+        assert validator.is_read_only("select * from users where deleted = false") is True
 
 # Test Schema Store
 class TestSchemaStore:
-    @patch('app.services.schema_store.OpenAIEmbeddings')
-    @patch('app.services.schema_store.PGVector')
+    @patch('app.services.schema_store.LocalEmbeddings')
+    @patch('app.services.schema_store.IndexedPGVector')
     def test_create_table_description(self, mock_pgvector, mock_embeddings):
         store = SchemaStore()
         columns = [
@@ -90,6 +116,66 @@ class TestSchemaStore:
         assert "id (integer) [PRIMARY KEY]" in desc
         assert "user_id (integer) [FOREIGN KEY]" in desc
 
+# Test Local Embeddings
+class TestLocalEmbeddings:
+    @patch('app.services.local_embeddings.LocalEmbeddings._verify_service')
+    def test_embed_documents_batches_requests(self, mock_verify):
+        embeddings = LocalEmbeddings(batch_size=2)
+        with patch.object(embeddings, '_request_embeddings', side_effect=lambda texts: [[len(t)] for t in texts]) as mock_request:
+            vectors = embeddings.embed_documents(["a", "bb", "ccc", "dddd", "eeeee"])
+        assert vectors == [[1], [2], [3], [4], [5]]
+        assert mock_request.call_count == 3
+        assert LocalEmbeddings(batch_size=0).batch_size == 1
+
+    @patch('app.services.local_embeddings.LocalEmbeddings._verify_service')
+    def test_request_array_reads_binary_response(self, mock_verify):
+        import numpy as np
+        vectors = np.arange(6, dtype="<f4").reshape(2, 3)
+        response = Mock(content=vectors.tobytes())
+        response.headers = {"Content-Type": "application/octet-stream", "X-Embedding-Shape": "2,3"}
+        with patch('app.services.local_embeddings._get_session') as mock_session:
+            mock_session.return_value.post.return_value = response
+            assert LocalEmbeddings().embed_documents(["a", "b"]) == vectors.tolist()
+    
+    def test_query_batcher_fails_on_short_response(self):
+        from app.services.local_embeddings import _QueryBatcher
+        batcher = _QueryBatcher(lambda texts: [[0.0]] * (len(texts) - 1), max_wait=0.05)
+        futures = [batcher.submit("a"), batcher.submit("b")]
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=5)
+    
+    def test_cached_embeddings_only_embed_misses(self):
+        inner = Mock()
+        inner.embed_documents.side_effect = lambda texts: [[float(len(t))] for t in texts]
+        cached = CachedEmbeddings(inner, provider="local", model="test")
+        hit = {hashlib.sha256(b"known").digest(): [9.0]}
+        with patch.object(cached, '_load', return_value=dict(hit)), patch.object(cached, '_store') as mock_store:
+            vectors = cached.embed_documents(["known", "new", "new"])
+        assert vectors == [[9.0], [3.0], [3.0]]
+        inner.embed_documents.assert_called_once_with(["new"])
+        assert len(mock_store.call_args[0][0]) == 1
+
+# Test Local RAG Service
+class TestLocalRAGService:
+    @patch('app.services.vector_index.IndexedPGVector')
+    def test_query_with_rag_reuses_vector_store(self, mock_pgvector):
+        service = LocalRAGService.__new__(LocalRAGService)
+        service.embeddings = Mock()
+        service._retrieval_cache = RetrievalCache()
+        service._llm = Mock()
+        service._llm.invoke.return_value = "answer"
+        mock_pgvector.return_value.similarity_search.return_value = [Mock(page_content="Table: users")]
+        
+        assert service.query_with_rag("how many users?", 1) == "answer"
+        assert service.query_with_rag("list users", 1) == "answer"
+        mock_pgvector.assert_called_once()
+        assert "Table: users" in service._llm.invoke.call_args[0][0]
+        
+        # Same question modulo case/whitespace is served from the retrieval cache
+        service.query_with_rag("  How many   USERS? ", 1)
+        assert mock_pgvector.return_value.similarity_search.call_count == 2
+
 # Test PII Redaction
 class TestPIIRedaction:
     def test_redact_email(self):
@@ -113,6 +199,21 @@ class TestPIIRedaction:
         ]
         redacted = redactor.redact_results(results)
         assert all("[EMAIL_ADDRESS]" in str(r.get("email", "")) for r in redacted)
+    
+    def test_presidio_skipped_for_plain_values(self):
+        redactor = PIIRedactor.__new__(PIIRedactor)
+        redactor.analyzer = Mock()
+        redactor._prefilter = True
+        assert redactor.redact_text("active") == "active"
+        assert redactor.redact_results([{"status": "pending"}]) == [{"status": "pending"}]
+        redactor.analyzer.analyze.assert_not_called()
+    
+    def test_presidio_runs_on_lowercase_values_for_ner_entities(self):
+        from app.services.pii_redaction import _HINTED_ENTITIES
+        redactor = PIIRedactor.__new__(PIIRedactor)
+        redactor._prefilter = _HINTED_ENTITIES.issuperset(PIIRedactor.DEFAULT_ENTITIES)
+        assert redactor._may_contain_pii("last week")
+        assert redactor._may_contain_pii("john smith")
 
 # Test Visualizer
 class TestVisualizer:
@@ -138,6 +239,32 @@ class TestVisualizer:
         rec = visualizer.recommend_visualization(results, "Count by category")
         assert rec.chart_type == ChartType.BAR
     
+    def test_analyze_column_types_by_column(self):
+        import pandas as pd
+        from decimal import Decimal
+        visualizer = Visualizer()
+        results = [{"day": f"2024-01-0{i}", "amount": Decimal(i), "note": None} for i in range(1, 5)]
+        types = visualizer._analyze_column_types(pd.DataFrame(results), ["day", "amount", "note"])
+        assert types == {"day": "datetime", "amount": "numeric", "note": "unknown"}
+    
+    def test_recommend_many_keeps_input_order(self):
+        visualizer = Visualizer()
+        series = [{"date": f"2024-01-0{i}", "sales": i} for i in range(1, 4)]
+        points = [{"x": i, "y": i * 2} for i in range(1, 4)]
+        recs = visualizer.recommend_many([series, points, []])
+        assert [r.chart_type for r in recs] == [ChartType.LINE, ChartType.SCATTER, ChartType.TABLE]
+        configs = visualizer.generate_many(recs, [series, points, []])
+        assert len(configs) == 3 and all("data" in c for c in configs)
+    
+    def test_plotly_config_keeps_integers_with_nulls(self):
+        visualizer = Visualizer()
+        results = [{"id": 9007199254740993, "n": 1}, {"id": None, "n": 2}]
+        rec = visualizer.recommend_visualization(results)
+        config = visualizer.generate_plotly_config(rec, results)
+        assert rec.chart_type == ChartType.SCATTER
+        assert config["data"][0]["x"] == [9007199254740993, None]
+        assert all(type(v) is int for v in config["data"][0]["y"])
+    
     def test_generate_plotly_config(self):
         visualizer = Visualizer()
         results = [{"x": 1, "y": 10}, {"x": 2, "y": 20}]
@@ -166,11 +293,21 @@ class TestSecurityManager:
         assert safe is False
         assert len(detected) > 0
     
+    def test_is_injection(self):
+        manager = SecurityManager()
+        assert manager.is_injection("SELECT * FROM users") is False
+        assert manager.is_injection("SELECT * FROM users WHERE a = 1 OR 1=1") is True
+    
     def test_validate_table_access(self):
         manager = SecurityManager()
         assert manager.validate_table_access(["users"], {"users", "orders"}) is True
         assert manager.validate_table_access(["admin"], {"users"}) is False
         assert manager.validate_table_access(["pg_catalog.users"]) is False
+    
+    def test_mask_connection_string(self):
+        manager = SecurityManager()
+        assert manager.mask_connection_string("postgresql://u:secret@h:5432/db") == "postgresql://u:****@h:5432/db"
+        assert "secret" not in manager.mask_connection_string("postgresql://u:secret@[::1/db")
 
 # Test Prompts
 class TestPrompts: